@@ -1,49 +1,281 @@
 #!/usr/bin/env python3
 
+from connections import ConnectionManager
+
 import yaml
 import pandas as pd
+import json
 import os
+import threading
 import streamlit_authenticator as stauth
 import utils
 
+# the accounts are shared by all the events
+ACCOUNTS_DB_PATH = os.path.join("db", "accounts.db")
+
+# the original store of the accounts, imported into the database on the first run
+ACCOUNTS_YAML_PATH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), "accounts.yaml"
+)
+
+# columns of the table `users`, other keys of the user dict (set by the authenticator) are kept in `extra`
+USER_COLUMNS = ["email", "name", "password", "role", "registered"]
+
+
+def normalize_email(email):
+    return email.strip().lower()
+
+
+def create_tables(conn):
+    conn.execute(
+        """CREATE TABLE if not exists users (
+            username text not null,
+            email text not null,
+            name text,
+            password text,
+            role text,
+            registered text,
+            extra text,
+            primary key(username)
+        );"""
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS users_email_lower ON users (LOWER(email))")
+    conn.execute(
+        """CREATE TABLE if not exists preauthorized_emails (
+            email text not null,
+            role text,
+            primary key(email)
+        );"""
+    )
+    # other configuration, e.g. the login cookie (values are JSON)
+    conn.execute(
+        """CREATE TABLE if not exists config (
+            key text not null,
+            value text,
+            primary key(key)
+        );"""
+    )
+
+
+def user_to_row(username, user):
+    extra = {
+        key: value
+        for key, value in user.items()
+        if key not in USER_COLUMNS and key != "username"
+    }
+
+    return (
+        username,
+        user.get("email") or "",
+        user.get("name"),
+        user.get("password"),
+        user.get("role"),
+        user.get("registered"),
+        json.dumps(extra) if extra else None,
+    )
+
+
+def row_to_user(row):
+    user = {column: row[column] for column in USER_COLUMNS if row[column] is not None}
+
+    if row["extra"]:
+        user.update(json.loads(row["extra"]))
+
+    return user
+
+
+def upsert_user(conn, username, user):
+    conn.execute(
+        "INSERT OR REPLACE INTO users (username, email, name, password, role, registered, extra) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        user_to_row(username, user),
+    )
+
+
+def import_yaml(conn, yaml_path):
+    # one-time import of the accounts from the YAML file used by the older versions of the app
+    with open(yaml_path) as f:
+        accounts = yaml.load(f, Loader=yaml.FullLoader)
+
+    usernames = accounts["credentials"]["usernames"] or {}
+    conn.executemany(
+        "INSERT OR REPLACE INTO users (username, email, name, password, role, registered, extra) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [user_to_row(username, user) for username, user in usernames.items()],
+    )
+
+    preauthorized = accounts.get("preauthorized_emails") or {}
+    conn.executemany(
+        "INSERT OR REPLACE INTO preauthorized_emails (email, role) VALUES (?, ?)",
+        [(email, info.get("role")) for email, info in preauthorized.items()],
+    )
+
+    conn.execute(
+        "INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)",
+        ("cookie", json.dumps(accounts["cookie"])),
+    )
+    conn.execute(
+        "INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)",
+        ("imported_from", yaml_path),
+    )
+
+    return len(usernames)
+
+
+class AccountStore:
+    # Accounts stored in SQLite (db/accounts.db), every change updates only the affected row.
+    # The dict in the format expected by streamlit-authenticator is built lazily on the first access
+    # and then kept up-to-date in memory together with the database.
+
+    def __init__(self, db_path=ACCOUNTS_DB_PATH, yaml_path=ACCOUNTS_YAML_PATH):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.connections = ConnectionManager(db_path)
+        self.lock = threading.Lock()
+        self.accounts = None
+        # incremented on every change, see `AccountManager.get_email_index`
+        self.version = 0
+
+        self.connections.write(lambda conn: self.init_db(conn, yaml_path)).result()
+
+    def init_db(self, conn, yaml_path):
+        create_tables(conn)
+
+        imported = conn.execute(
+            "SELECT value FROM config WHERE key = 'imported_from'"
+        ).fetchone()
+
+        if not imported and os.path.exists(yaml_path):
+            user_cnt = import_yaml(conn, yaml_path)
+            utils.log(f"Imported {user_cnt} accounts from {yaml_path}", level="info")
+
+    def get_accounts(self):
+        with self.lock:
+            if self.accounts is None:
+                self.accounts = self.load_accounts()
+
+            return self.accounts
+
+    def load_accounts(self):
+        utils.log("Loading accounts...")
+        conn = self.connections.get()
+
+        usernames = {
+            row["username"]: row_to_user(row)
+            for row in conn.execute("SELECT * FROM users")
+        }
+        preauthorized = {
+            row["email"]: {"role": row["role"]}
+            for row in conn.execute("SELECT * FROM preauthorized_emails")
+        }
+        cookie = conn.execute(
+            "SELECT value FROM config WHERE key = 'cookie'"
+        ).fetchone()
+
+        return {
+            "credentials": {"usernames": usernames},
+            "preauthorized_emails": preauthorized,
+            "cookie": json.loads(cookie["value"]) if cookie else None,
+        }
+
+    def write(self, fn):
+        self.connections.write(fn).result()
+        self.version += 1
+
+    def save_user(self, username, user):
+        self.write(lambda conn: upsert_user(conn, username, user))
+
+    def rename_user(self, orig_username, username, user):
+        def rename(conn):
+            conn.execute("DELETE FROM users WHERE username = ?", (orig_username,))
+            upsert_user(conn, username, user)
+
+        self.write(rename)
+
+    def delete_user(self, username):
+        self.write(
+            lambda conn: conn.execute(
+                "DELETE FROM users WHERE username = ?", (username,)
+            )
+        )
+
+    def save_preauthorized_email(self, email, role):
+        self.write(
+            lambda conn: conn.execute(
+                "INSERT OR REPLACE INTO preauthorized_emails (email, role) VALUES (?, ?)",
+                (email, role),
+            )
+        )
+
+    def close(self):
+        self.connections.close()
+
+
+store = None
+store_lock = threading.Lock()
+
+
+def get_store():
+    # a single store shared by the account managers of all the events
+    global store
+
+    with store_lock:
+        if store is None:
+            store = AccountStore()
+
+        return store
+
+
+def close_store():
+    # e.g. before the database file is replaced, the store is re-opened on the next access
+    global store
+
+    with store_lock:
+        if store is not None:
+            store.close()
+            store = None
+
+
+def reset_store(db_path=ACCOUNTS_DB_PATH):
+    # removes the database, so that the accounts are imported from accounts.yaml again on the next access
+    # (e.g. after restoring an older backup which contains only the YAML)
+    close_store()
+
+    for path in [db_path, f"{db_path}-wal", f"{db_path}-shm"]:
+        if os.path.exists(path):
+            os.remove(path)
+
 
 class AccountManager:
     def __init__(self):
-        self.accounts_file = os.path.join(
-            os.path.dirname(os.path.realpath(__file__)), "accounts.yaml"
-        )
-        self.accounts = None
+        # normalized email -> username, see `get_email_index()`
+        self.email_index = None
+        self.email_index_key = None
+
+    @property
+    def store(self):
+        return get_store()
+
+    @property
+    def accounts(self):
+        return self.store.get_accounts()
 
-    def save_accounts(self, authenticator, accounts):
+    def sync_authenticator(self, authenticator, accounts):
         if authenticator:
             authenticator.authentication_handler.credentials = accounts["credentials"]
             authenticator.authentication_handler.pre_authorized = {
                 "emails": accounts["preauthorized_emails"]
             }
 
-        self.accounts = accounts
-
-        with open(self.accounts_file, "w") as f:
-            yaml.dump(accounts, f)
-
     def get_accounts(self, authenticator):
-        if not self.accounts:
-            utils.log("Reloading accounts...")
-
-            with open(self.accounts_file) as f:
-                self.accounts = yaml.load(f, Loader=yaml.FullLoader)
+        accounts = self.store.get_accounts()
 
         if authenticator:
             # update accounts
-            self.accounts[
-                "credentials"
-            ] = authenticator.authentication_handler.credentials
+            accounts["credentials"] = authenticator.authentication_handler.credentials
 
-        if self.accounts["credentials"]["usernames"] is None:
+        if accounts["credentials"]["usernames"] is None:
             # None would be non-iterable, we need an empty dict
-            self.accounts["credentials"]["usernames"] = {}
+            accounts["credentials"]["usernames"] = {}
 
-        return self.accounts
+        return accounts
 
     def get_user_by_username(self, authenticator, username):
         accounts = self.get_accounts(authenticator)
@@ -54,20 +286,59 @@ class AccountManager:
 
         return user
 
+    def save_user(self, authenticator, username):
+        # store the current state of the user, e.g. after the authenticator registered them
+        accounts = self.get_accounts(authenticator)
+        user = accounts["credentials"]["usernames"][username]
+
+        self.store.save_user(username, user)
+        self.sync_authenticator(authenticator, accounts)
+
     def update_user_name(self, authenticator, username, name):
         accounts = self.get_accounts(authenticator)
 
         accounts["credentials"]["usernames"][username]["name"] = name.strip()
 
-        self.save_accounts(authenticator, accounts)
+        self.save_user(authenticator, username)
 
-    def get_user_by_email(self, authenticator, email):
+    def get_email_index(self, authenticator):
         accounts = self.get_accounts(authenticator)
+        usernames = accounts["credentials"]["usernames"]
+
+        # the index is rebuilt after the changes in the store and after the authenticator
+        # registers a new user (the number of users changes) or replaces the credentials (a new dict)
+        key = (id(usernames), len(usernames), self.store.version)
 
-        for username, user in accounts["credentials"]["usernames"].items():
-            if user["email"].strip().lower() == email.strip().lower():
-                user["username"] = username
-                return user
+        if self.email_index is None or self.email_index_key != key:
+            self.email_index = {}
+
+            for username, user in usernames.items():
+                # keep the first account if more accounts share the same e-mail
+                self.email_index.setdefault(normalize_email(user["email"]), username)
+
+            self.email_index_key = key
+
+        return self.email_index
+
+    def get_user_by_email(self, authenticator, email):
+        username = self.get_email_index(authenticator).get(normalize_email(email))
+
+        if username is None:
+            return None
+
+        usernames = self.get_accounts(authenticator)["credentials"]["usernames"]
+        user = usernames.get(username)
+
+        if user is None or normalize_email(user["email"]) != normalize_email(email):
+            # the accounts were modified in place, rebuild the index and try again
+            self.email_index = None
+            username = self.get_email_index(authenticator).get(normalize_email(email))
+            user = usernames.get(username)
+
+        if user:
+            user["username"] = username
+
+        return user
 
     def update_or_create_account(
         self,
@@ -84,20 +355,29 @@ class AccountManager:
             accounts["credentials"]["usernames"][username]["name"] = name.strip()
             accounts["credentials"]["usernames"][username]["email"] = email
             accounts["credentials"]["usernames"][username]["role"] = role
+
+            self.store.save_user(
+                username, accounts["credentials"]["usernames"][username]
+            )
         else:
             accounts["credentials"]["usernames"][username] = accounts["credentials"][
                 "usernames"
             ].pop(orig_username)
             accounts["credentials"]["usernames"][username]["username"] = username
 
-        self.save_accounts(authenticator, accounts)
+            self.store.rename_user(
+                orig_username, username, accounts["credentials"]["usernames"][username]
+            )
+
+        self.sync_authenticator(authenticator, accounts)
 
     def delete_account(self, authenticator, username):
         accounts = self.get_accounts(authenticator)
 
         del accounts["credentials"]["usernames"][username]
 
-        self.save_accounts(authenticator, accounts)
+        self.store.delete_user(username)
+        self.sync_authenticator(authenticator, accounts)
 
     def set_password(self, authenticator, username, new_password):
         accounts = self.get_accounts(authenticator)
@@ -109,7 +389,7 @@ class AccountManager:
 
         accounts["credentials"]["usernames"][username]["password"] = password_hash
 
-        self.save_accounts(authenticator, accounts)
+        self.save_user(authenticator, username)
         return True
 
     def get_preauthorized_accounts(self, authenticator):
@@ -128,4 +408,5 @@ class AccountManager:
 
         accounts["preauthorized_emails"][email] = {"role": role}
 
-        self.save_accounts(authenticator, accounts)
+        self.store.save_preauthorized_email(email, role)
+        self.sync_authenticator(authenticator, accounts)
@@ -206,7 +206,6 @@ def action_manage_users(db):
         )
 
         st.success("Účastník uložen")
-        utils.clear_cache()
         return True
 
     if delete_button:
@@ -321,7 +320,7 @@ def action_manage_participants(db):
             photo_img = participant["photo"]
 
             if photo_img:
-                st.image(db.read_image(photo_img, thumbnail="150_square"))
+                st.image(db.read_image(photo_img, thumbnail="150_square", encoded=True))
 
         cols = st.columns([1, 6, 1])
         submit_button = cols[0].form_submit_button(label="Uložit")
@@ -336,6 +335,8 @@ def action_manage_participants(db):
             st.error("E-mail nesmí být prázdný")
             st.stop()
 
+        utils.check_uploaded_photo(photo)
+
         ret = db.update_or_create_participant(
             participant_id=participant["id"],
             name=name,
@@ -349,7 +350,6 @@ def action_manage_participants(db):
             st.stop()
 
         st.success("Účastník uložen")
-        utils.clear_cache()
         return True
 
     if delete_button:
@@ -457,7 +457,7 @@ def action_manage_teams(db):
             photo_img = team["team_photo"]
 
             if photo_img:
-                st.image(db.read_image(photo_img, thumbnail="150_square"))
+                st.image(db.read_image(photo_img, thumbnail="150_square", encoded=True))
 
         cols = st.columns([1, 6, 1])
         submit_button = cols[0].form_submit_button(label="Uložit")
@@ -472,6 +472,8 @@ def action_manage_teams(db):
             st.error("Vyber alespoň jednoho člena týmu.")
             st.stop()
 
+        utils.check_uploaded_photo(photo)
+
         ret = db.update_or_create_team(
             team_name=name,
             team_motto=motto,
@@ -906,7 +908,6 @@ def action_set_events(db):
 
     if btn_active:
         db.set_active_event(active_event["year"])
-        utils.clear_cache()
         st.success("Aktivní akce nastavena")
 
     st.markdown("#### Nastavit akci")
@@ -984,7 +985,6 @@ def action_set_events(db):
             product_id=event_product_id,
             budget_per_person=budget_per_person,
         )
-        utils.clear_cache()
         st.success("Nastavení uloženo.")
 
     st.markdown("#### Založit novou akci")
@@ -1006,7 +1006,6 @@ def action_set_events(db):
         )
         st.balloons()
         time.sleep(2)
-        utils.clear_cache()
         st.rerun()
 
 
@@ -1212,6 +1211,19 @@ def action_set_system_settings(db):
     if cache_btn:
         return True
 
+    st.markdown("#### Cache obrázků a videí")
+    st.caption(
+        "Velikost cache lze nastavit v souboru `settings.yaml` (klíč `media_cache_mb`)."
+    )
+    st.json(db.media_cache.get_stats())
+
+    if db.get_settings_value("file_system") == "s3":
+        st.markdown("#### Lokální cache souborů z S3")
+        st.caption(
+            "Velikost cache lze nastavit v souboru `settings.yaml` (klíč `disk_cache_mb`)."
+        )
+        st.json(db.disk_cache.get_stats())
+
     st.markdown("#### Obnovit databázi ze zálohy")
     action_restore_db(db)
 
@@ -1294,7 +1306,6 @@ def show_actions(db):
             ret = action_set_system_settings(db)
 
     if ret is True:
-        utils.clear_cache()
         st.balloons()
         time.sleep(2)
         st.rerun()
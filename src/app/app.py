@@ -1,4 +1,7 @@
 import streamlit as st
+from database import upgrade_databases
+
+upgrade_databases()
 
 dashboard = st.Page("sites/dashboard.py", title="Hlavní stránka", icon="🪧")
 posts = st.Page("sites/posts.py", title="Příspěvky", icon="🔵")
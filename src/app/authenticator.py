@@ -17,6 +17,20 @@ db = get_database(event_id=event_id)
 
 def get_logged_info():
     username = st.session_state["username"]
+
+    # the user context is kept in the session until the data it is computed from changes
+    # (participants or teams of the event, accounts)
+    key = (
+        username,
+        db.event["year"],
+        db.get_data_version("participants", "teams"),
+        db.am.store.version,
+    )
+    context = st.session_state.get("user_context")
+
+    if context and context["key"] == key:
+        return context["user"], context["team"]
+
     authenticator = st.session_state.get("authenticator")
     user = db.am.get_user_by_username(authenticator, username)
     if not user:
@@ -25,11 +39,10 @@ def get_logged_info():
     participant = db.get_participant_by_email(user["email"])
     user["pax_id"] = participant["id"] if participant else None
 
-    if not user:
-        st.stop()
-
     team = db.get_team_for_user(user["pax_id"])
 
+    st.session_state["user_context"] = {"key": key, "user": user, "team": team}
+
     return user, team
 
 
@@ -43,9 +56,8 @@ def register_new_user(authenticator, email, username):
     user["role"] = role
     user["registered"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-    # authenticator is up-to-date, we just need to update the accounts
-    accounts = db.am.get_accounts(authenticator)
-    db.am.save_accounts(authenticator, accounts)
+    # authenticator is up-to-date, we just need to store the new account
+    db.am.save_user(authenticator, username)
 
 
 def reset_password_form(authenticator):
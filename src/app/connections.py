@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+
+from concurrent.futures import Future
+
+import queue
+import sqlite3
+import threading
+
+
+# pragmas applied to every connection (journal_mode is persistent, the rest are per-connection)
+PRAGMAS = [
+    "PRAGMA journal_mode = WAL",
+    # in WAL mode, NORMAL is still safe against corruption, it only skips the fsync on every commit
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA foreign_keys = OFF",
+    "PRAGMA temp_store = MEMORY",
+    # ~16 MB page cache and 128 MB memory-mapped I/O per connection
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 134217728",
+]
+
+# maximum number of queued writes committed together in a single transaction
+GROUP_COMMIT_MAX_WRITES = 64
+
+
+class ConnectionManager:
+    # Keeps one SQLite connection per thread so that page renders running in different
+    # Streamlit session threads can read in parallel (WAL mode: readers do not block writers).
+    # Streamlit spawns a new thread for every script run, so connections of finished threads
+    # are closed lazily whenever a new connection is opened.
+    #
+    # All writes go through a single writer thread (see `write()`), which commits everything
+    # queued in the meantime as one transaction (group commit), so concurrent writers neither
+    # contend for the database lock nor pay for an fsync each.
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.connections = {}
+        self.local = threading.local()
+        self.write_queue = queue.Queue()
+        self.writer = None
+
+    def connect(self):
+        # check_same_thread=False only so that `close()` can close connections of other threads,
+        # each connection is otherwise used by its own thread only
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+
+        return conn
+
+    def get(self):
+        conn = getattr(self.local, "conn", None)
+
+        if conn is not None:
+            return conn
+
+        conn = self.connect()
+        thread = threading.current_thread()
+
+        with self.lock:
+            self.prune()
+            self.connections[thread.ident] = (thread, conn)
+
+        self.local.conn = conn
+        return conn
+
+    def prune(self):
+        # close the connections of threads which are no longer running
+        for ident, (thread, conn) in list(self.connections.items()):
+            if not thread.is_alive():
+                conn.close()
+                del self.connections[ident]
+
+    def write(self, fn):
+        # schedule `fn(conn)` to run in the writer thread, the returned future is resolved
+        # with the return value of `fn` (or its exception) once the transaction is committed
+        future = Future()
+
+        with self.lock:
+            if self.writer is None:
+                self.writer = threading.Thread(
+                    target=self.run_writer, name="sqlite-writer", daemon=True
+                )
+                self.writer.start()
+
+            self.write_queue.put((fn, future))
+
+        return future
+
+    def run_writer(self):
+        conn = self.connect()
+        # transactions are managed explicitly
+        conn.isolation_level = None
+
+        while True:
+            batch, stop = self.next_batch()
+
+            if batch:
+                self.commit_batch(conn, batch)
+
+            if stop:
+                break
+
+        conn.close()
+
+    def next_batch(self):
+        # block until there is some work, then take everything queued in the meantime
+        item = self.write_queue.get()
+        batch = []
+
+        while item is not None:
+            batch.append(item)
+
+            if len(batch) >= GROUP_COMMIT_MAX_WRITES:
+                return batch, False
+
+            try:
+                item = self.write_queue.get_nowait()
+            except queue.Empty:
+                return batch, False
+
+        # `None` is the signal to stop the writer
+        return batch, True
+
+    def commit_batch(self, conn, batch):
+        # future -> (result, error)
+        results = {}
+        # writes of the currently open transaction, their outcome is known only after it is committed
+        uncommitted = []
+
+        try:
+            for fn, future in batch:
+                if not conn.in_transaction:
+                    conn.execute("BEGIN IMMEDIATE")
+
+                # a failing write is rolled back on its own without affecting the rest of the batch
+                conn.execute("SAVEPOINT write")
+                try:
+                    result, error = fn(conn), None
+                except Exception as e:
+                    result, error = None, e
+
+                if not conn.in_transaction:
+                    # the write committed or rolled back the transaction on its own, so neither
+                    # the earlier writes of the transaction nor the write itself can be trusted
+                    error = sqlite3.OperationalError(
+                        "The transaction was ended by one of the writes"
+                    )
+                    for pending in uncommitted + [future]:
+                        results[pending] = (None, error)
+
+                    uncommitted = []
+                    continue
+
+                if error is not None:
+                    conn.execute("ROLLBACK TO write")
+                    conn.execute("RELEASE write")
+                    results[future] = (None, error)
+                    continue
+
+                conn.execute("RELEASE write")
+                uncommitted.append(future)
+                results[future] = (result, None)
+
+            if conn.in_transaction:
+                conn.execute("COMMIT")
+
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+
+            for _, future in batch:
+                future.set_exception(e)
+
+            return
+
+        for future, (result, error) in results.items():
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def close(self):
+        with self.lock:
+            if self.writer is not None:
+                # the writer finishes all the queued writes first
+                self.write_queue.put(None)
+                self.writer.join()
+                self.writer = None
+
+            for _, conn in self.connections.values():
+                conn.close()
+
+            self.connections = {}
+
+        # force every thread (including the current one) to reconnect
+        self.local = threading.local()
@@ -1,32 +1,44 @@
 #!/usr/bin/env python3
 
+from collections import OrderedDict
 from datetime import datetime
 from PIL import Image, ImageOps
 from slugify import slugify
 from unidecode import unidecode
 from woocommerce import API
-from accounts import AccountManager
+from connections import ConnectionManager
+from media_cache import get_media_cache
+from disk_cache import get_disk_cache
 
 from zipfile import ZipFile
 from gpxpy.gpx import GPX, GPXRoute, GPXRoutePoint, GPXWaypoint
 from geopy.geocoders import Nominatim
 from currency_converter import CurrencyConverter, SINGLE_DAY_ECB_URL
 
+import accounts
 import argparse
 import boto3
+import botocore
 import csv
+import functools
 import io
+import itertools
 import json
 import logging
+import migrations
 import mimetypes
 import os
 import pandas as pd
 import re
 import s3fs
+import scores
+import search
+import thumbnails
 import sqlite3
 import streamlit as st
 import utils
 import yaml
+import weakref
 import zipfile
 import base64
 import copy
@@ -34,8 +46,12 @@ import locale
 
 
 import shutil
+import stat
 import tempfile
+import threading
+import time
 import ast
+import urllib.parse
 import urllib.request
 import dateutil.parser
 
@@ -45,12 +61,102 @@ current_dir = os.path.dirname(os.path.realpath(__file__))
 # TODO find a way how to retrieve this value from the config
 TTL = 3600 * 24
 
+# media are served to the browser by URL (see `Database.get_media_url`): presigned S3 URLs are valid for a week
+# and the same URL is reused for a day so that the browser can cache the files
+PRESIGNED_URL_EXPIRES = 7 * 24 * 3600
+PRESIGNED_URL_REUSE = 24 * 3600
+# maximum number of the presigned URLs kept for reuse
+PRESIGNED_URLS_MAX_ENTRIES = 4096
+
+# local files are hard-linked (or copied) into the folder served by Streamlit (`enableStaticServing`),
+# i.e. `app/static/media/...`, Streamlit does not serve symlinks pointing outside of the folder
+STATIC_MEDIA_DIR = os.path.join(current_dir, "static", "media")
+STATIC_MEDIA_URL = "app/static/media"
+
+# Streamlit serves other static files as text/plain, those are streamed through the websocket instead
+STATIC_SERVING_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".webp")
+
+# storage class of the archival copies of the uploaded photos in S3 (see `Database.archive_photo`)
+ARCHIVE_STORAGE_CLASS = "GLACIER_IR"
+
+# source of the data versions, see `Database.bump_data_version`
+# globally increasing so that a version is never reused (not even after the database is reloaded)
+data_version_counter = itertools.count(1)
+
+# maximum number of results kept by `Database.cached`
+QUERY_CACHE_MAX_ENTRIES = 256
+
+# the data versions know only about the writes of this process, the results are recomputed
+# after this many seconds so that the changes made by other processes (e.g. the CLI) show up as well
+QUERY_CACHE_TTL = 60
+
+
+# all the instances (one per event), see `clear_query_caches`
+databases = weakref.WeakSet()
+
+
+def clear_query_caches():
+    # e.g. when running out of memory, the results are computed again on the next access
+    for db in list(databases):
+        db.clear_query_cache()
+
+
+def close_connections():
+    # e.g. before the database files are replaced, the connections are re-opened on the next access
+    for db in list(databases):
+        db.connections.close()
+
+
+def cached_query(*tables):
+    # caches the result of a Database method until one of `tables` is modified
+    # the arguments of the method have to be hashable
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            key = (fn.__name__, args, tuple(sorted(kwargs.items())))
+            return self.cached(key, tables, lambda: fn(self, *args, **kwargs))
+
+        return wrapper
+
+    return decorator
+
 
 @st.cache_resource
 def get_database(event_id):
     return Database(event_id)
 
 
+@st.cache_resource
+def upgrade_databases():
+    # runs once per server process, the databases of the archived events are upgraded as well
+    migrations.migrate_all()
+
+
+def copy_result(result):
+    # cached results are shared, the callers get their own copy which they can modify
+    if isinstance(result, pd.DataFrame):
+        return result.copy()
+
+    if isinstance(result, (list, dict, tuple)):
+        return copy.deepcopy(result)
+
+    return result
+
+
+def get_sqlite_type(column):
+    # the same column types as pandas `to_sql` uses for SQLite
+    if pd.api.types.is_bool_dtype(column) or pd.api.types.is_integer_dtype(column):
+        return "INTEGER"
+
+    if pd.api.types.is_float_dtype(column):
+        return "REAL"
+
+    if pd.api.types.is_datetime64_any_dtype(column):
+        return "TIMESTAMP"
+
+    return "TEXT"
+
+
 class Database:
     def __init__(self, event_id=None):
         self.settings_path = os.path.join(current_dir, "settings.yaml")
@@ -64,7 +170,7 @@ class Database:
             timeout=30,
         )
         self.event = self.get_event_by_id(event_id)
-        self.conn = self.get_db_for_event(self.event["year"])
+        self.get_db_for_event(self.event["year"])
 
         if self.get_settings_value("file_system") == "s3":
             # S3 bucket
@@ -77,8 +183,28 @@ class Database:
                 aws_access_key_id=st.secrets["aws"]["AWS_ACCESS_KEY_ID"],
                 aws_secret_access_key=st.secrets["aws"]["AWS_SECRET_ACCESS_KEY"],
             )
+            # local copies of the files downloaded from S3
+            self.disk_cache = get_disk_cache()
+            self.disk_cache.set_max_bytes(
+                int(self.get_settings_value("disk_cache_mb") or 2048) * 1024 * 1024
+            )
         self.top_dir = f"files/{self.event['year']}"
-        self.am = AccountManager()
+        # S3 key -> (presigned URL, time of generating), the least recently used first
+        self.presigned_urls = OrderedDict()
+        self.presigned_urls_lock = threading.Lock()
+        self.media_cache = get_media_cache()
+        self.media_cache.set_max_bytes(
+            int(self.get_settings_value("media_cache_mb") or 256) * 1024 * 1024
+        )
+        self.am = accounts.AccountManager()
+        # table name -> version of its data, changes after every write to the table
+        self.data_versions = {}
+        # key -> (data versions, result, time of computing), see `cached()`
+        self.query_cache = OrderedDict()
+        self.query_cache_lock = threading.Lock()
+        databases.add(self)
+        self.preauthorized_emails = None
+        self.preauthorized_emails_key = None
         self.static_imgs = self.load_static_images()
         self.fa_icons = self.load_fa_icons()
         self.geoloc = Nominatim(user_agent="GetLoc")
@@ -96,7 +222,70 @@ class Database:
         utils.log(f"Database `{self.get_year()}` initialized")
 
     def __del__(self):
-        self.conn.close()
+        self.connections.close()
+
+    @property
+    def conn(self):
+        # each thread gets its own connection, see `ConnectionManager`
+        return self.connections.get()
+
+    def write(self, fn, tables=()):
+        # all modifications run as `fn(conn)` in the single writer thread
+        # we wait until the group commit containing our write is done
+        # `tables` are the tables modified by `fn`, their data versions are bumped after the commit
+        result = self.connections.write(fn).result()
+        self.bump_data_version(*tables)
+
+        return result
+
+    def execute_write(self, query, params=(), tables=()):
+        return self.write(lambda conn: conn.execute(query, params).rowcount, tables)
+
+    def bump_data_version(self, *tables):
+        for table in tables:
+            self.data_versions[table] = next(data_version_counter)
+
+    def get_data_version(self, *tables):
+        # "accounts" stands for the account store shared by all the events
+        return tuple(
+            self.am.store.version
+            if table == "accounts"
+            else self.data_versions.get(table, 0)
+            for table in tables
+        )
+
+    def cached(self, key, tables, compute):
+        # the result of `compute()` is reused until the data version of one of `tables` changes,
+        # so that a write invalidates only the results which depend on the modified tables
+        version = self.get_data_version(*tables)
+
+        with self.query_cache_lock:
+            entry = self.query_cache.get(key)
+
+            if (
+                entry is not None
+                and entry[0] == version
+                and time.time() - entry[2] < QUERY_CACHE_TTL
+            ):
+                self.query_cache.move_to_end(key)
+                return copy_result(entry[1])
+
+        # the version is read before computing, a concurrent write makes the entry outdated
+        computed = time.time()
+        result = compute()
+
+        with self.query_cache_lock:
+            self.query_cache[key] = (version, result, computed)
+            self.query_cache.move_to_end(key)
+
+            while len(self.query_cache) > QUERY_CACHE_MAX_ENTRIES:
+                self.query_cache.popitem(last=False)
+
+        return copy_result(result)
+
+    def clear_query_cache(self):
+        with self.query_cache_lock:
+            self.query_cache.clear()
 
     def get_events(self):
         return sorted(
@@ -118,9 +307,8 @@ class Database:
         os.makedirs(os.path.join("db", event_id), exist_ok=True)
         self.db_path = os.path.join("db", event_id, "database.db")
 
-        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
-        self.conn.row_factory = sqlite3.Row
-        self.create_tables()
+        self.connections = ConnectionManager(self.db_path)
+        self.upgrade_schema()
 
         return self.conn
 
@@ -136,6 +324,7 @@ class Database:
         return event["gmaps_url"]
 
     def get_event(self):
+        self.reload_settings_if_changed()
         return self.event
 
     def get_active_event(self):
@@ -185,13 +374,29 @@ class Database:
         st.session_state["event"] = self.get_active_event()
 
     def load_settings(self):
+        # the modification time is remembered so that the changes made by other instances
+        # (e.g. the database of another event) are picked up, see `reload_settings_if_changed`
+        self.settings_mtime = os.path.getmtime(self.settings_path)
+
         with open(self.settings_path) as f:
             self.settings = yaml.safe_load(f)
 
+    def reload_settings_if_changed(self):
+        if os.path.getmtime(self.settings_path) == self.settings_mtime:
+            return
+
+        self.load_settings()
+
+        # the event info may have changed as well
+        if hasattr(self, "event"):
+            self.event = self.get_event_by_id(self.event["year"])
+
     def get_settings_value(self, key):
+        self.reload_settings_if_changed()
         return self.settings.get(key)
 
     def set_settings_value(self, key, value):
+        self.reload_settings_if_changed()
         self.settings[key] = value
         self.save_settings()
 
@@ -199,6 +404,8 @@ class Database:
         with open(self.settings_path, "w") as f:
             yaml.dump(self.settings, f)
 
+        self.settings_mtime = os.path.getmtime(self.settings_path)
+
     def load_static_images(self):
         static_images = {"topx.png": None}
 
@@ -225,13 +432,35 @@ class Database:
         if not os.path.exists(zip_path):
             raise ValueError(f"Backup file {zip_path} does not exist.")
 
-        # overwrite the database in db folder and the accounts in src/app/accounts.yaml by unzipping the backup
-        # the zip file contains the folders db/ and src/
+        # close the connections of all the events so that the WAL gets checkpointed and removed
+        # before overwriting the databases, the old WAL would be applied to the restored database otherwise
+        close_connections()
+        accounts.close_store()
+
         with zipfile.ZipFile(zip_path, "r") as zip_ref:
+            backup_files = zip_ref.namelist()
+
+            # left e.g. by another process which still has the database open
+            for db_file in [f for f in backup_files if f.endswith(".db")]:
+                for path in [f"{db_file}-wal", f"{db_file}-shm"]:
+                    if os.path.exists(path):
+                        utils.log(f"Removing stale {path}", level="warning")
+                        os.remove(path)
+
+            # overwrite the databases in db folder (including the accounts in db/accounts.db) by unzipping the backup
+            # the zip file contains the folder db/ (and src/ with accounts.yaml in the older backups)
             zip_ref.extractall(".")
 
+        # the older backups have only the YAML, the accounts are then imported from it
+        if (
+            "db/accounts.db" not in backup_files
+            and "src/app/accounts.yaml" in backup_files
+        ):
+            accounts.reset_store()
+
         # reload the database
         self.__init__()
+        # the databases of all the events were replaced, the other instances must not be reused
         utils.clear_cache()
 
     # @st.cache_resource(ttl=TTL, show_spinner=False)
@@ -239,23 +468,53 @@ class Database:
         obj = _self.boto3.Object(_self.fs_bucket, filepath)
         return obj
 
-    # @st.cache_resource(ttl=TTL, max_entries=50, show_spinner=False)
+    def read_s3_file(_self, filepath):
+        # read-through the local disk cache, the cached copy is revalidated using its ETag once in a while
+        cached = _self.disk_cache.get(filepath)
+
+        if cached and _self.disk_cache.is_fresh(cached):
+            return cached["content"]
+
+        try:
+            obj = _self.get_boto3_object(filepath)
+
+            if cached and cached["etag"]:
+                response = obj.get(IfNoneMatch=cached["etag"])
+            else:
+                response = obj.get()
+
+            content = response["Body"].read()
+        except botocore.exceptions.ClientError as e:
+            code = e.response.get("Error", {}).get("Code")
+
+            if cached and code in ("304", "NotModified"):
+                _self.disk_cache.mark_validated(filepath)
+                return cached["content"]
+
+            if code in ("404", "NoSuchKey"):
+                if cached:
+                    _self.disk_cache.invalidate(filepath)
+                return None
+
+            utils.log(f"Cannot read {filepath} from S3: {e}", level="warning")
+            # better a possibly outdated copy than nothing
+            return cached["content"] if cached else None
+        except Exception as e:
+            return cached["content"] if cached else None
+
+        _self.disk_cache.put(filepath, content, response.get("ETag"))
+        return content
+
     def read_file(_self, filepath, mode="b"):
         fs = _self.get_settings_value("file_system")
         if fs == "s3" and not filepath.startswith("static/"):
-            # use boto3 to get the S3 object
-            try:
-                obj = _self.get_boto3_object(filepath)
-                # read the contents of the file and return
-                content = obj.get()["Body"].read()
+            content = _self.read_s3_file(filepath)
 
-                # text files need decoding
-                if mode == "t":
-                    return content.decode("utf-8")
+            # text files need decoding
+            if content is not None and mode == "t":
+                return content.decode("utf-8")
 
-                return content
-            except Exception as e:
-                return None
+            return content
 
         elif fs == "local" or filepath.startswith("static/"):
             # if does not exist, return None
@@ -268,9 +527,17 @@ class Database:
 
     def delete_file(self, filepath):
         fs = self.get_settings_value("file_system")
+        self.media_cache.invalidate(filepath)
+
+        if self.get_media(filepath) is not None:
+            self.write(
+                lambda conn: thumbnails.delete_media(conn, filepath), tables=["media"]
+            )
+
         if fs == "s3" and not filepath.startswith("static/"):
             # use boto3 to get the S3 object
             try:
+                self.disk_cache.invalidate(filepath)
                 obj = self.get_boto3_object(filepath)
                 obj.delete()
             except Exception as e:
@@ -279,82 +546,356 @@ class Database:
 
         elif fs == "local" or filepath.startswith("static/"):
             os.remove(filepath)
+            # the file must not stay reachable at its URL
+            self.unpublish_static_file(filepath)
         else:
             raise ValueError(f"Unknown file system: {fs}, use s3 or local.")
 
-    def save_thumbnail(self, filepath, img):
-        img_byte_array = io.BytesIO()
-        img = img.convert("RGB")
-        img.save(img_byte_array, format="JPEG")
-        img_bytes = img_byte_array.getvalue()
+    def create_thumbnails(self, content, filepath, oriented=False):
+        # returns {size: encoded thumbnail}, the thumbnails are recorded in the manifest
+        # utils.log(f"Creating thumbnails for {filepath}.", level="debug")
+        return self.save_thumbnails(
+            filepath,
+            thumbnails.render_thumbnails(content, oriented),
+            thumbnails.get_content_hash(content),
+        )
 
-        self.write_file(filepath, img_bytes)
+    def save_thumbnails(self, filepath, created, content_hash=None):
+        for size, thumbnail_content in created.items():
+            self.write_file(
+                thumbnails.get_thumbnail_path(filepath, size), thumbnail_content
+            )
 
-    def create_thumbnails(self, img, filepath):
-        # utils.log(f"Creating thumbnails for {filepath}.", level="debug")
-        filepath = os.path.splitext(filepath)[0]
+        self.set_media_variants(filepath, created.keys(), content_hash)
+        media = self.get_media(filepath)
+
+        for size, thumbnail_content in created.items():
+            self.media_cache.put(
+                filepath, thumbnail_content, thumbnails.get_cache_key(size, media)
+            )
+
+        return created
+
+    def get_photo_policy(self):
+        # how the uploaded photos are stored, see `utils.normalize_photo`
+        return {
+            "max_size": int(self.get_settings_value("photo_max_size") or 0) or None,
+            "quality": int(self.get_settings_value("photo_quality") or 90),
+        }
+
+    def ingest_photo(self, photo, dir_path):
+        # stores the uploaded photo (and its archival copy) and schedules its thumbnails, returns its path
+        photo_content, photo_name, normalized = utils.postprocess_uploaded_photo(
+            photo, **self.get_photo_policy()
+        )
+        photo_path = os.path.join(dir_path, photo_name)
+
+        self.archive_photo(
+            photo_path, photo.getvalue(), os.path.splitext(photo.name)[1].lower()
+        )
+        self.write_file(filepath=photo_path, content=photo_content)
+        self.schedule_thumbnails(photo_path, photo_content, normalized)
 
-        img_100 = utils.resize_image(img, max_width=100, crop_ratio="1:1")
-        self.save_thumbnail(f"{filepath}_100_square.jpg", img_100)
+        return photo_path
 
-        img_150 = utils.resize_image(img, max_width=150, crop_ratio="1:1")
-        self.save_thumbnail(f"{filepath}_150_square.jpg", img_150)
+    def archive_photo(self, filepath, content, suffix):
+        # keeps the photo as it was uploaded under `photo_archive_prefix` (if set), e.g. before it is downscaled
+        prefix = self.get_settings_value("photo_archive_prefix")
 
-        img_1000 = utils.resize_image(img, max_width=1000)
-        self.save_thumbnail(f"{filepath}_1000.jpg", img_1000)
+        if not prefix:
+            return
+
+        archive_path = os.path.join(prefix, os.path.splitext(filepath)[0] + suffix)
+
+        if self.get_settings_value("file_system") == "s3":
+            self.boto3.Object(self.fs_bucket, archive_path).put(
+                Body=content, StorageClass=ARCHIVE_STORAGE_CLASS
+            )
+        else:
+            self.write_file(archive_path, content)
+
+    def get_photo_paths(self):
+        # all the uploaded photos: in the posts, of the teams and of the participants
+        paths = []
+
+        for row in self.conn.execute("SELECT files FROM posts"):
+            files = json.loads(row["files"] or "[]")
+            paths += [f["path"] for f in files if f["type"].startswith("image")]
+
+        for query in [
+            "SELECT team_photo FROM teams WHERE team_photo IS NOT NULL AND team_photo != ''",
+            "SELECT photo FROM participants WHERE photo IS NOT NULL AND photo != ''",
+        ]:
+            paths += [row[0] for row in self.conn.execute(query)]
+
+        return [path for path in paths if not path.startswith("static/")]
+
+    def normalize_photos(self):
+        # applies the current photo policy (and the orientation normalization) to the photos uploaded before
+        policy = self.get_photo_policy()
+        normalized_cnt = 0
+
+        for filepath in self.get_photo_paths():
+            media = self.get_media(filepath)
+
+            if media and media["normalized"] and not policy["max_size"]:
+                continue
+
+            content = self.read_file(filepath)
+
+            if not content:
+                utils.log(f"Cannot load image: {filepath}", level="warning")
+                continue
+
+            normalized_content, normalized = utils.normalize_photo(content, **policy)
+
+            # the manifest is left as it is for the photos which were not rewritten,
+            # i.e. those with nothing to normalize and those which cannot be normalized (e.g. unreadable ones)
+            if not normalized or normalized_content is content:
+                continue
+
+            self.archive_photo(filepath, content, os.path.splitext(filepath)[1])
+            self.write_file(filepath, normalized_content)
+            self.create_thumbnails(normalized_content, filepath, oriented=True)
+            normalized_cnt += 1
+
+            self.write(
+                lambda conn: thumbnails.set_normalized(
+                    conn, filepath, thumbnails.get_content_hash(normalized_content)
+                ),
+                tables=["media"],
+            )
+
+        utils.log(f"Normalized {normalized_cnt} photos", level="success")
+        return normalized_cnt
+
+    def schedule_thumbnails(self, filepath, content, normalized=False):
+        # called right after an image is uploaded, the thumbnails are rendered in a worker process
+        # `normalized` photos (see `utils.postprocess_uploaded_photo`) do not need the EXIF orientation applied
+        content_hash = thumbnails.get_content_hash(content)
+        self.set_media_variants(filepath, [], content_hash, normalized=normalized)
+
+        thumbnails.submit(
+            filepath,
+            content,
+            lambda created: self.save_thumbnails(filepath, created, content_hash),
+            oriented=normalized,
+            max_workers=int(
+                self.get_settings_value("thumbnail_workers")
+                or thumbnails.DEFAULT_WORKERS
+            ),
+        )
+
+    def get_media(self, filepath):
+        return thumbnails.get_media(self.conn, filepath)
+
+    def set_media_variants(
+        self, filepath, variants, content_hash=None, normalized=None
+    ):
+        self.write(
+            lambda conn: thumbnails.set_variants(
+                conn, filepath, variants, content_hash, normalized
+            ),
+            tables=["media"],
+        )
 
-    # @st.cache_resource(max_entries=1, show_spinner=False)
     def read_video(_self, filepath):
-        return _self.read_file(filepath, mode="b")
+        content = _self.media_cache.get(filepath)
 
-    # @st.cache_resource(max_entries=500, show_spinner=False)
-    def read_image(_self, filepath, thumbnail=None):
-        # TODO simplify
-        file_extension = os.path.splitext(filepath)[1]
+        if content is None:
+            content = _self.read_file(filepath, mode="b")
+            _self.media_cache.put(filepath, content)
 
-        thumbnail_size = thumbnail or "100_square"  # 100_square is just for the checks
-        thumbnail_filepath = filepath.replace(file_extension, f"_{thumbnail_size}.jpg")
-        thumbnail_img = _self.read_file(thumbnail_filepath, mode="b")
+        return content
 
-        # if there are no thumbnails for the current image, create the thumbnails
-        if not thumbnail_img:
-            # try to find a thumbnail of a suitable size:
-            img = _self.read_file(filepath, mode="b")
+    def read_image_bytes(_self, filepath, thumbnail=None):
+        # encoded contents of the image (or its thumbnail), served from the media cache if possible
+        if thumbnail:
+            # the image may have been just uploaded and its thumbnails are being rendered
+            thumbnails.wait_pending(filepath)
+            media = _self.get_media(filepath)
 
-            if not img:
-                utils.log(f"Cannot load image: {filepath}", level="error")
-                # return blank image
-                return Image.new("RGB", (1, 1))
+            content = _self.media_cache.get(
+                filepath, thumbnails.get_cache_key(thumbnail, media)
+            )
 
-            # read image using PIL
-            try:
-                img = Image.open(io.BytesIO(img))
-                img = ImageOps.exif_transpose(img)
-            except Exception as e:
-                utils.log(f"Cannot read image: {filepath}", level="error")
-                # return blank image
-                return Image.new("RGB", (1, 1))
+            if content is None:
+                content = _self.read_thumbnail(filepath, thumbnail, media)
 
-            # if the image was successfully loaded, create thumbnails
-            _self.create_thumbnails(img, filepath)
+            return content
 
-            try:
-                thumbnail_img = _self.read_file(thumbnail_filepath, mode="b")
-            except:
-                utils.log(f"Cannot load thumbnail: {thumbnail_filepath}", level="error")
-                # return blank image
-                return Image.new("RGB", (1, 1))
+        content = _self.media_cache.get(filepath)
 
+        if content is None:
+            content = _self.read_file(filepath, mode="b")
+            _self.media_cache.put(filepath, content)
+
+        return content
+
+    def read_thumbnail(_self, filepath, thumbnail, media):
+        thumbnail_filepath = thumbnails.get_thumbnail_path(filepath, thumbnail)
+
+        if media is None or media["variants"] is None:
+            # not in the manifest yet (uploaded before the manifest existed): probe the file system once
+            thumbnail_img = _self.read_file(thumbnail_filepath, mode="b")
+
+            if thumbnail_img:
+                _self.set_media_variants(filepath, thumbnails.THUMBNAIL_SIZES)
+                _self.media_cache.put(
+                    filepath, thumbnail_img, thumbnails.get_cache_key(thumbnail, None)
+                )
+                return thumbnail_img
+
+        elif thumbnail in media["variants"]:
+            thumbnail_img = _self.read_file(thumbnail_filepath, mode="b")
+
+            if thumbnail_img:
+                _self.media_cache.put(
+                    filepath, thumbnail_img, thumbnails.get_cache_key(thumbnail, media)
+                )
+                return thumbnail_img
+
+            utils.log(f"Thumbnail in the manifest is missing: {thumbnail_filepath}")
+
+        # if there are no thumbnails for the current image (e.g. the background job failed), create the thumbnails
+        img = _self.read_file(filepath, mode="b")
+
+        if not img:
+            utils.log(f"Cannot load image: {filepath}", level="error")
+            return None
+
+        try:
+            created = _self.create_thumbnails(
+                img, filepath, oriented=bool(media and media["normalized"])
+            )
+        except Exception as e:
+            utils.log(f"Cannot read image: {filepath}", level="error")
+            return None
+
+        return created.get(thumbnail)
+
+    def get_media_url(self, filepath, thumbnail=None):
+        # URL the browser loads the file (or its thumbnail) from, so that the file does not pass through the app
+        # None if the file cannot be served by URL (`read_image` / `read_video` has to be used instead)
         if thumbnail:
-            filepath = thumbnail_filepath
-            img = thumbnail_img
-        else:
-            img = _self.read_file(filepath, mode="b")
+            thumbnails.wait_pending(filepath)
+            media = self.get_media(filepath)
+
+            if media is None or thumbnail not in (media["variants"] or []):
+                # creates the thumbnails (or records the existing ones in the manifest)
+                if not self.read_image_bytes(filepath, thumbnail):
+                    return None
+
+            filepath = thumbnails.get_thumbnail_path(filepath, thumbnail)
+
+        fs = self.get_settings_value("file_system")
+
+        if fs == "s3" and not filepath.startswith("static/"):
+            return self.get_presigned_url(filepath)
+
+        return self.get_static_url(filepath)
+
+    def get_presigned_url(self, filepath):
+        with self.presigned_urls_lock:
+            url, generated = self.presigned_urls.get(filepath, (None, 0))
+
+            if url is not None and time.time() - generated <= PRESIGNED_URL_REUSE:
+                self.presigned_urls.move_to_end(filepath)
+                return url
+
+        # signing is done locally, no request to S3
+        url = self.boto3.meta.client.generate_presigned_url(
+            "get_object",
+            Params={
+                "Bucket": self.fs_bucket,
+                "Key": filepath,
+                "ResponseCacheControl": f"private, max-age={PRESIGNED_URL_REUSE}",
+            },
+            ExpiresIn=PRESIGNED_URL_EXPIRES,
+        )
+
+        with self.presigned_urls_lock:
+            self.presigned_urls[filepath] = (url, time.time())
+            self.presigned_urls.move_to_end(filepath)
+
+            while len(self.presigned_urls) > PRESIGNED_URLS_MAX_ENTRIES:
+                self.presigned_urls.popitem(last=False)
+
+        return url
+
+    def get_static_url(self, filepath):
+        if not filepath.lower().endswith(STATIC_SERVING_EXTENSIONS):
+            return None
+
+        static_path = os.path.join(STATIC_MEDIA_DIR, filepath)
+
+        try:
+            source = os.stat(filepath)
+        except OSError:
+            return None
+
+        try:
+            served = os.lstat(static_path)
+        except OSError:
+            served = None
+
+        # a hard link is the same file, a copy has the same size and modification time,
+        # anything else (e.g. the file was replaced since) is published again
+        if served is None or not (
+            os.path.samestat(source, served)
+            or (
+                stat.S_ISREG(served.st_mode)
+                and served.st_size == source.st_size
+                and served.st_mtime == source.st_mtime
+            )
+        ):
+            self.publish_static_file(filepath, static_path)
+
+        return f"{STATIC_MEDIA_URL}/{urllib.parse.quote(filepath.replace(os.sep, '/'))}"
+
+    def publish_static_file(self, filepath, static_path):
+        os.makedirs(os.path.dirname(static_path), exist_ok=True)
+        # replaced at once so that the browser never gets a partially written file
+        tmp_path = f"{static_path}.{threading.get_ident()}.tmp"
+
+        try:
+            os.link(filepath, tmp_path)
+        except OSError:
+            # e.g. the files are on a different file system
+            shutil.copy2(filepath, tmp_path)
+
+        os.replace(tmp_path, static_path)
+
+    def unpublish_static_file(self, filepath):
+        # removes the served copies of the file and of its thumbnails, see `get_static_url`
+        for path in [filepath] + [
+            thumbnails.get_thumbnail_path(filepath, size)
+            for size in thumbnails.THUMBNAIL_SIZES
+        ]:
+            try:
+                os.remove(os.path.join(STATIC_MEDIA_DIR, path))
+            except OSError:
+                pass
+
+    def read_image(_self, filepath, thumbnail=None, encoded=False):
+        # with `encoded=True`, the stored file is returned as it is (the thumbnails are already oriented JPEGs),
+        # so it does not need to be decoded and re-encoded for display
+        img = _self.read_image_bytes(filepath, thumbnail)
+
+        if not img:
+            # return blank image
+            return Image.new("RGB", (1, 1))
+
+        if encoded:
+            return img
 
         # read image using PIL
         try:
             img = Image.open(io.BytesIO(img))
-            img = ImageOps.exif_transpose(img)
+
+            # the thumbnails and the photos normalized at upload are upright already
+            if not thumbnail and not _self.is_normalized(filepath):
+                img = ImageOps.exif_transpose(img)
         except Exception as e:
             utils.log(f"Cannot read image: {filepath}", level="error")
             # return blank image
@@ -362,11 +903,17 @@ class Database:
 
         return img
 
+    def is_normalized(self, filepath):
+        media = self.get_media(filepath)
+        return bool(media and media["normalized"])
+
     def write_file(self, filepath, content):
         fs = self.get_settings_value("file_system")
+        self.media_cache.invalidate(filepath)
 
         if fs == "s3" and not filepath.startswith("static/"):
-            self.boto3.Object(self.fs_bucket, filepath).put(Body=content)
+            response = self.boto3.Object(self.fs_bucket, filepath).put(Body=content)
+            self.disk_cache.put(filepath, content, response.get("ETag"))
         elif fs == "local" or filepath.startswith("static/"):
             mode = "t" if type(content) == str else "b"
 
@@ -447,44 +994,58 @@ class Database:
 
         self.add_wc_participants(new_participants)
 
-        utils.clear_cache()
-
         pb.progress(1.0, "Hotovo!")
 
     def get_preauthorized_emails(self):
-        participants = self.get_participants(include_non_registered=True)
-
-        emails = []
-        if not participants.empty:
-            # extract the field `email` from pandas df
-            emails = list(participants.email)
-
-        authenticator = st.session_state.get("authenticator")
-        extra_allowed_emails = list(
-            self.am.get_preauthorized_accounts(authenticator).keys()
-        )
-        preauthorized = [e.lower() for e in emails + extra_allowed_emails]
+        # participants of the event and the extra allowed e-mails (admins etc.),
+        # recomputed only after the participants or the accounts change
+        key = (self.get_data_version("participants"), self.am.store.version)
+
+        if self.preauthorized_emails is None or self.preauthorized_emails_key != key:
+            emails = [
+                row["email"]
+                for row in self.conn.execute("SELECT email FROM participants")
+            ]
+            authenticator = st.session_state.get("authenticator")
+            extra_allowed_emails = list(
+                self.am.get_preauthorized_accounts(authenticator).keys()
+            )
+            self.preauthorized_emails = [
+                accounts.normalize_email(e) for e in emails + extra_allowed_emails
+            ]
+            self.preauthorized_emails_key = key
 
-        return preauthorized
+        # a copy, the authenticator may modify the list
+        return list(self.preauthorized_emails)
 
     def add_wc_participants(self, new_participants):
-        for user in new_participants:
-            user_data = (
+        rows = [
+            (
                 str(int(user["id"])),
                 user["email"],
                 user["first_name"].title() + " " + user["last_name"].title(),
             )
+            for user in new_participants
+        ]
 
-            self.conn.execute(
+        def insert_participants(conn):
+            before = conn.total_changes
+            conn.executemany(
                 "INSERT OR IGNORE INTO participants (id, email, name_web) VALUES (?, ?, ?)",
-                user_data,
+                rows,
             )
-            self.conn.commit()
+            added = conn.total_changes - before
+            search.refresh_search_index(conn, "participant", [row[0] for row in rows])
+            return added
+
+        added = self.write(insert_participants, tables=["participants"])
+        utils.log(f"Imported {len(rows)} participants ({added} new)", level="success")
 
     def wc_get_user_by_email(self, email):
         query = "SELECT * FROM participants WHERE email = ?"
         return self.conn.execute(query, (email,)).fetchone()
 
+    @cached_query("participants", "teams", "accounts")
     def get_participants(
         self, sort_by_name=True, include_non_registered=False, fetch_teams=False
     ):
@@ -499,7 +1060,7 @@ class Database:
         for pax_info in self.conn.execute(query).fetchall():
             pax_info = dict(pax_info)
 
-            # this may be too slow, todo speedup
+            # a hash lookup in the e-mail index of the accounts
             user_info = self.am.get_user_by_email(authenticator, pax_info["email"])
             if user_info:
                 pax_info.update(user_info)
@@ -558,6 +1119,7 @@ class Database:
         query = "SELECT * FROM participants WHERE LOWER(email) = LOWER(?)"
         return self.conn.execute(query, (email,)).fetchone() is not None
 
+    @cached_query("participants", "accounts")
     def get_participant_by_id(self, id):
         if id == "" or id is None:
             return None
@@ -583,7 +1145,7 @@ class Database:
         return pax_info
 
     def get_participant_by_email(self, email):
-        query = "SELECT * FROM participants WHERE lower(email) = lower(?)"
+        query = "SELECT * FROM participants WHERE LOWER(email) = LOWER(?)"
         return self.conn.execute(query, (email,)).fetchone()
 
     def update_or_create_participant(
@@ -599,44 +1161,49 @@ class Database:
 
         if photo is None:
             query = "INSERT OR REPLACE INTO participants (id, email, name_web, bio, emergency_contact) VALUES (?, ?, ?, ?, ?)"
-            self.conn.execute(
-                query, (participant_id, email, name, bio, emergency_contact)
+            self.write_participant(
+                participant_id,
+                query,
+                (participant_id, email, name, bio, emergency_contact),
             )
-            self.conn.commit()
             utils.log(f"Updated participant {name}", level="info")
 
         else:
             query = "INSERT OR REPLACE INTO participants (id, email, name_web, bio, emergency_contact, photo) VALUES (?, ?, ?, ?, ?, ?)"
 
-            photo_content, photo_name = utils.postprocess_uploaded_photo(photo)
-
             dir_path = os.path.join(self.top_dir, "participants", slugify(name))
+            photo_path = self.ingest_photo(photo, dir_path)
 
-            photo_path = os.path.join(dir_path, photo_name)
-
-            self.write_file(
-                filepath=os.path.join(dir_path, photo_name), content=photo_content
-            )
-
-            self.conn.execute(
-                query, (participant_id, email, name, bio, emergency_contact, photo_path)
+            self.write_participant(
+                participant_id,
+                query,
+                (participant_id, email, name, bio, emergency_contact, photo_path),
             )
-            self.conn.commit()
 
             utils.log(f"Updated participant {name}", level="info")
 
         return True
 
+    def write_participant(self, participant_id, query, params):
+        # participant update, keeping the search index in sync
+        def update(conn):
+            conn.execute(query, params)
+            search.refresh_search_index(conn, "participant", [participant_id])
+
+        self.write(update, tables=["participants"])
+
     def delete_participant(self, participant_id):
-        query = "DELETE FROM participants WHERE id = ?"
-        self.conn.execute(query, (participant_id,))
-        self.conn.commit()
+        def delete(conn):
+            query = "DELETE FROM participants WHERE id = ?"
+            conn.execute(query, (participant_id,))
+            search.refresh_search_index(conn, "participant", [participant_id])
+
+            # if a participant is a member of team, set it to None
+            for member in ["member1", "member2", "member3"]:
+                query = f"UPDATE teams SET {member} = NULL WHERE {member} = ?"
+                conn.execute(query, (participant_id,))
 
-        # if a participant is a member of team, set it to None
-        for member in ["member1", "member2", "member3"]:
-            query = f"UPDATE teams SET {member} = NULL WHERE {member} = ?"
-            self.conn.execute(query, (participant_id,))
-            self.conn.commit()
+        self.write(delete, tables=["participants", "teams"])
 
     def update_participant_info(
         self, username, email, bio, emergency_contact, photo=None
@@ -645,36 +1212,71 @@ class Database:
             query = (
                 "UPDATE participants SET bio = ?, emergency_contact = ? WHERE email = ?"
             )
-            self.conn.execute(query, (bio, emergency_contact, email))
-            self.conn.commit()
+            self.write_participant_by_email(
+                email, query, (bio, emergency_contact, email)
+            )
 
         else:
             query = "UPDATE participants SET bio = ?, emergency_contact = ?, photo = ? WHERE email = ?"
 
             dir_path = os.path.join(self.top_dir, "participants", slugify(username))
+            photo_path = self.ingest_photo(photo, dir_path)
 
-            photo_content, photo_name = utils.postprocess_uploaded_photo(photo)
+            self.write_participant_by_email(
+                email, query, (bio, emergency_contact, photo_path, email)
+            )
 
-            photo_path = os.path.join(dir_path, photo_name)
+            utils.log(f"Updated info for {username}", level="info")
 
-            self.write_file(
-                filepath=os.path.join(dir_path, photo_name), content=photo_content
-            )
+    def write_participant_by_email(self, email, query, params):
+        def update(conn):
+            conn.execute(query, params)
+            participant = conn.execute(
+                "SELECT id FROM participants WHERE email = ?", (email,)
+            ).fetchone()
 
-            self.conn.execute(query, (bio, emergency_contact, photo_path, email))
-            self.conn.commit()
+            if participant:
+                search.refresh_search_index(conn, "participant", [participant["id"]])
 
-            utils.log(f"Updated info for {username}", level="info")
+        self.write(update, tables=["participants"])
 
     def get_table_as_df(self, table_name):
-        df = pd.read_sql_query(f"SELECT * FROM {table_name}", self.conn)
-        return df
+        return self.cached(
+            ("get_table_as_df", table_name),
+            [table_name],
+            lambda: pd.read_sql_query(f"SELECT * FROM {table_name}", self.conn),
+        )
 
     def save_df_as_table(self, df, table_name):
         # remove rows containing **ONLY** NaNs
         df = df.dropna(how="all")
 
-        df.to_sql(table_name, self.conn, if_exists="replace", index=False)
+        columns = ", ".join(
+            f'"{column}" {get_sqlite_type(df[column])}' for column in df.columns
+        )
+        placeholders = ", ".join("?" for _ in df.columns)
+        # NaNs are stored as NULLs
+        rows = list(
+            df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+        )
+
+        def replace_table(conn):
+            # not using `to_sql`, it commits on its own and would break the group commit of the writer
+            conn.execute(f"DROP TABLE IF EXISTS {table_name}")
+            conn.execute(f"CREATE TABLE {table_name} ({columns})")
+            conn.executemany(f"INSERT INTO {table_name} VALUES ({placeholders})", rows)
+            # the table is recreated without the indexes
+            migrations.create_indexes(conn)
+            migrations.create_feed_index(conn)
+
+            if table_name in scores.SCORED_TABLES:
+                scores.refresh_team_scores(conn)
+
+            if table_name in search.INDEXED_TABLES:
+                search.refresh_search_index(conn, search.INDEXED_TABLES[table_name])
+
+        # `team_scores` may be refreshed as well, see above
+        self.write(replace_table, tables=[table_name, "team_scores"])
 
     def get_post_by_id(self, post_id):
         query = "SELECT * FROM posts WHERE post_id = ?"
@@ -711,17 +1313,22 @@ class Database:
 
         files_json = []
 
+        # validate all the photos before storing any of them
+        for file in files:
+            if file.type.startswith("image"):
+                utils.validate_uploaded_photo(file)
+
         for i, file in enumerate(files):
             # if it's a photo, we need to process it
             if file.type.startswith("image"):
-                file_content, file_name = utils.postprocess_uploaded_photo(file)
+                file_path = self.ingest_photo(file, dir_path)
             elif file.type.startswith("video"):
                 file_content, file_name = utils.postprocess_uploaded_video(file)
 
-                # ... ignore the rest
+                file_path = os.path.join(dir_path, file_name)
+                self.write_file(filepath=file_path, content=file_content)
 
-            file_path = os.path.join(dir_path, file_name)
-            self.write_file(filepath=file_path, content=file_content)
+                # ... ignore the rest
 
             # TODO return type from postprocessing
             files_json.append({"path": file_path, "type": file.type})
@@ -737,22 +1344,26 @@ class Database:
         team_id = str(team["team_id"])
         action_id = action.get("id") if action_type != "story" else None
 
-        self.conn.execute(
-            f"INSERT INTO posts (post_id, pax_id, team_id, action_type, action_id, action_name, comment, files, created, flags) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-            (
-                post_id,
-                pax_id,
-                team_id,
-                action_type,
-                action_id,
-                title,
-                comment,
-                files_json,
-                created,
-                str(flags) if flags is not None else None,
-            ),
-        )
-        self.conn.commit()
+        def insert_post(conn):
+            conn.execute(
+                f"INSERT INTO posts (post_id, pax_id, team_id, action_type, action_id, action_name, comment, files, created, flags) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    post_id,
+                    pax_id,
+                    team_id,
+                    action_type,
+                    action_id,
+                    title,
+                    comment,
+                    files_json,
+                    created,
+                    str(flags) if flags is not None else None,
+                ),
+            )
+            scores.refresh_team_scores(conn, [team_id])
+            search.refresh_search_index(conn, "post", [post_id])
+
+        self.write(insert_post, tables=["posts", "team_scores"])
 
         utils.log(
             f"{user['username']} ({team['team_name']}) added post '{title}'",
@@ -800,8 +1411,20 @@ class Database:
                 filename = os.path.join("files", os.path.basename(file["path"]))
 
                 if file_type == "image":
-                    file = self.read_image(file["path"], thumbnail="1000")
-                    file.save(os.path.join(output_dir, filename))
+                    # the thumbnail is stored as JPEG, it is copied without re-encoding
+                    filename = os.path.join(
+                        "files",
+                        os.path.basename(
+                            thumbnails.get_thumbnail_path(file["path"], "1000")
+                        ),
+                    )
+                    file = self.read_image(file["path"], thumbnail="1000", encoded=True)
+
+                    if isinstance(file, bytes):
+                        with open(os.path.join(output_dir, filename), "wb") as f:
+                            f.write(file)
+                    else:
+                        file.save(os.path.join(output_dir, filename))
                 else:
                     file = self.read_video(file["path"])
                     with open(os.path.join(output_dir, filename), "wb") as f:
@@ -1064,6 +1687,7 @@ class Database:
 
         # return members
 
+    @cached_query("teams")
     def get_teams_with_awards(self):
         # any team that has a non-empty award column (non-empty = NULL or "")
         return pd.read_sql_query(
@@ -1073,27 +1697,33 @@ class Database:
     def set_team_award(self, team_id, award):
         if award is None:
             # delete the row with team_id from the table
-            self.conn.execute(
-                "UPDATE teams SET award = NULL WHERE team_id = ?", (team_id,)
+            self.execute_write(
+                "UPDATE teams SET award = NULL WHERE team_id = ?",
+                (team_id,),
+                tables=["teams"],
             )
         else:
-            self.conn.execute(
-                "UPDATE teams SET award = ? WHERE team_id = ?", (award, team_id)
+            self.execute_write(
+                "UPDATE teams SET award = ? WHERE team_id = ?",
+                (award, team_id),
+                tables=["teams"],
             )
-        self.conn.commit()
         utils.log(f"Set award {award} for team {team_id}", level="info")
 
     def update_or_create_notification(self, notification_id, name, text, category):
-        self.conn.execute(
+        self.execute_write(
             "INSERT OR REPLACE INTO notifications (id, name, text, type) VALUES (?, ?, ?, ?)",
             (notification_id, name, text, category),
+            tables=["notifications"],
         )
-        self.conn.commit()
         utils.log(f"Updated notification {name}", level="info")
 
     def delete_notification(self, notification_id):
-        self.conn.execute("DELETE FROM notifications WHERE id = ?", (notification_id,))
-        self.conn.commit()
+        self.execute_write(
+            "DELETE FROM notifications WHERE id = ?",
+            (notification_id,),
+            tables=["notifications"],
+        )
         utils.log(f"Deleted notification {notification_id}", level="info")
 
     def update_or_create_checkpoint(
@@ -1107,67 +1737,120 @@ class Database:
         points,
         points_challenge,
     ):
-        self.conn.execute(
-            "INSERT OR REPLACE INTO checkpoints (id, name, description, challenge, latitude, longitude, points, points_challenge) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-            (
-                checkpoint_id,
-                name,
-                description,
-                challenge,
-                lat,
-                lon,
-                points,
-                points_challenge,
-            ),
-        )
-        self.conn.commit()
+        def replace_checkpoint(conn):
+            query = "SELECT name, points, points_challenge FROM checkpoints WHERE id = ? OR name = ?"
+            scoring_before = [
+                tuple(row) for row in conn.execute(query, (checkpoint_id, name))
+            ]
+
+            conn.execute(
+                "INSERT OR REPLACE INTO checkpoints (id, name, description, challenge, latitude, longitude, points, points_challenge) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    checkpoint_id,
+                    name,
+                    description,
+                    challenge,
+                    lat,
+                    lon,
+                    points,
+                    points_challenge,
+                ),
+            )
+
+            # posts are matched to checkpoints also by name, see `scores.POST_POINTS_QUERY`
+            if scoring_before != [(name, points, points_challenge)]:
+                scores.refresh_team_scores(conn)
+
+        self.write(replace_checkpoint, tables=["checkpoints", "team_scores"])
         utils.log(f"Updated checkpoint {name}", level="info")
 
     def delete_checkpoint(self, checkpoint_id):
-        self.conn.execute("DELETE FROM checkpoints WHERE id = ?", (checkpoint_id,))
-        self.conn.commit()
+        def delete(conn):
+            conn.execute("DELETE FROM checkpoints WHERE id = ?", (checkpoint_id,))
+            scores.refresh_team_scores(conn)
+
+        self.write(delete, tables=["checkpoints", "team_scores"])
         utils.log(f"Deleted checkpoint {checkpoint_id}", level="info")
 
     def update_or_create_challenge(
         self, challenge_id, name, description, category, points
     ):
-        self.conn.execute(
-            "INSERT OR REPLACE INTO challenges (id, name, description, category, points) VALUES (?, ?, ?, ?, ?)",
-            (challenge_id, name, description, category, points),
-        )
-        self.conn.commit()
+        def replace_challenge(conn):
+            query = "SELECT name, points FROM challenges WHERE id = ? OR name = ?"
+            scoring_before = [
+                tuple(row) for row in conn.execute(query, (challenge_id, name))
+            ]
+
+            conn.execute(
+                "INSERT OR REPLACE INTO challenges (id, name, description, category, points) VALUES (?, ?, ?, ?, ?)",
+                (challenge_id, name, description, category, points),
+            )
+
+            # posts are matched to challenges also by name, see `scores.POST_POINTS_QUERY`
+            if scoring_before != [(name, points)]:
+                scores.refresh_team_scores(conn)
+
+        self.write(replace_challenge, tables=["challenges", "team_scores"])
         utils.log(f"Updated challenge {name}", level="info")
 
     def delete_challenge(self, challenge_id):
-        self.conn.execute("DELETE FROM challenges WHERE id = ?", (challenge_id,))
-        self.conn.commit()
+        def delete(conn):
+            conn.execute("DELETE FROM challenges WHERE id = ?", (challenge_id,))
+            scores.refresh_team_scores(conn)
+
+        self.write(delete, tables=["challenges", "team_scores"])
         utils.log(f"Deleted challenge {challenge_id}", level="info")
 
     def import_checkpoints(self, df):
-        for _, row in df.iterrows():
+        rows = []
+
+        # `to_dict` converts the values to Python types which can be bound by sqlite3
+        for row in df.to_dict("records"):
             latitude, longitude = row["gps"].split(",")
-            checkpoint_id = slugify(str(row["name"]))
-            self.update_or_create_checkpoint(
-                checkpoint_id,
-                row["name"],
-                row["description"],
-                row["challenge"],
-                latitude,
-                longitude,
-                row["points"],
-                row["points_challenge"],
+            rows.append(
+                (
+                    slugify(str(row["name"])),
+                    row["name"],
+                    row["description"],
+                    row["challenge"],
+                    latitude,
+                    longitude,
+                    row["points"],
+                    row["points_challenge"],
+                )
+            )
+
+        def replace_checkpoints(conn):
+            conn.executemany(
+                "INSERT OR REPLACE INTO checkpoints (id, name, description, challenge, latitude, longitude, points, points_challenge) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
             )
+            scores.refresh_team_scores(conn)
+
+        self.write(replace_checkpoints, tables=["checkpoints", "team_scores"])
+        utils.log(f"Imported {len(rows)} checkpoints", level="success")
 
     def import_challenges(self, df):
-        for _, row in df.iterrows():
-            challenge_id = slugify(str(row["name"]))
-            self.update_or_create_challenge(
-                challenge_id,
+        rows = [
+            (
+                slugify(str(row["name"])),
                 row["name"],
                 row["description"],
                 row["category"],
                 row["points"],
             )
+            for row in df.to_dict("records")
+        ]
+
+        def replace_challenges(conn):
+            conn.executemany(
+                "INSERT OR REPLACE INTO challenges (id, name, description, category, points) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            scores.refresh_team_scores(conn)
+
+        self.write(replace_challenges, tables=["challenges", "team_scores"])
+        utils.log(f"Imported {len(rows)} challenges", level="success")
 
     def get_action(self, action_id, action_type, action_name):
         # retrieve action from the database, return a single Python object or None
@@ -1194,81 +1877,31 @@ class Database:
             action = ret.fetchone()
             return dict(action) if action else None
 
-    def get_points_for_action(self, action_id, action_type, action_name, flags):
-        if action_type == "story":
-            return 0
-
-        if flags:
-            flags = ast.literal_eval(flags)
-
-        action = self.get_action(action_id, action_type, action_name)
-
-        if not action:
-            utils.log(f"Action {action_name} not found", level="warning")
-            return 0
-
-        pts = action.get("points", 0)
-
-        if (
-            action_type == "checkpoint"
-            and action.get("points_challenge")
-            and flags
-            and flags.get("checkpoint_challenge_completed")
-        ):
-            pts += action.get("points_challenge")
-
-        return pts
-
-    def get_team_overview(self, team_id, posts, participants):
-        # filter posts by team_id
-        posts_team = posts[posts["team_id"] == team_id]
-
-        # for each post, find a particular action by its `action_name` in the table `challenges`, `checkpoints`, etc. (determined according its action_type) and add the number of points to the post
-
-        # Use the apply() function to apply the get_points function to each row in the DataFrame
-        if not posts_team.empty:
-            posts_team = posts_team.assign(
-                points=posts_team.apply(
-                    lambda row: self.get_points_for_action(
-                        action_id=row.get("action_id"),
-                        action_type=row["action_type"],
-                        action_name=row["action_name"],
-                        flags=row["flags"],
-                    ),
-                    axis=1,
-                )
-            )
+    def get_posts_with_points(self):
+        # all posts with the points they are worth, computed in a single query
+        return pd.read_sql_query(
+            scores.POST_POINTS_QUERY, self.conn, params=scores.POST_POINTS_PARAMS
+        )
 
-        team = self.get_team_by_id(team_id)
+    def get_spent_by_team(self):
+        query = "SELECT team_id, SUM(amount_czk) AS spent FROM budget GROUP BY team_id"
+        return {row["team_id"]: row["spent"] for row in self.conn.execute(query)}
 
-        member1_name = participants[participants["id"] == team["member1"]].to_dict(
-            "records"
-        )[0]
-        member1_name = member1_name["name"]
-
-        member2_name = ""
-        if team["member2"]:
-            member2_name = participants[participants["id"] == team["member2"]].to_dict(
-                "records"
-            )[0]
-            member2_name = member2_name["name"]
-
-        member3_name = ""
-        if team["member3"]:
-            member3_name = participants[participants["id"] == team["member3"]].to_dict(
-                "records"
-            )[0]
-            member3_name = member3_name["name"]
+    def get_team_overview(self, team, posts_team, participant_names, spent=None):
+        member_names = {
+            member: participant_names.get(team[member], "") if team[member] else ""
+            for member in ["member1", "member2", "member3"]
+        }
 
         team_info = {
-            "team_id": team_id,
+            "team_id": team["team_id"],
             "team_name": team["team_name"],
             "member1": team["member1"],
-            "member1_name": member1_name,
+            "member1_name": member_names["member1"],
             "member2": team["member2"],
-            "member2_name": member2_name,
+            "member2_name": member_names["member2"],
             "member3": team["member3"],
-            "member3_name": member3_name,
+            "member3_name": member_names["member3"],
             "points": posts_team["points"].sum() if not posts_team.empty else 0,
             "posts": posts_team,
             "award": team["award"],
@@ -1279,19 +1912,19 @@ class Database:
             "team_web": team["team_web"],
         }
 
-        if self.event.get("budget_per_person"):
-            spendings = self.get_spendings_by_team(team)
-            team_info["spent"] = spendings["amount_czk"].sum()
+        if spent is not None:
+            team_info["spent"] = spent.get(team["team_id"], 0)
 
         return team_info
 
     def get_teams_overview(self):
+        # the number of queries does not depend on the number of teams or posts
         teams = self.get_table_as_df("teams")
 
         if teams.empty:
             return []
 
-        posts = self.get_table_as_df("posts")
+        posts = self.get_posts_with_points()
         participants = self.get_participants(
             include_non_registered=True, sort_by_name=False
         )
@@ -1299,14 +1932,73 @@ class Database:
         if participants.empty:
             return []
 
+        participant_names = dict(zip(participants["id"], participants["name"]))
+        posts_by_team = dict(tuple(posts.groupby("team_id")))
+        no_posts = posts.iloc[0:0]
+
+        spent = None
+        if self.event.get("budget_per_person"):
+            spent = self.get_spent_by_team()
+
         # get team overview for each team
         teams_info = [
-            self.get_team_overview(team_id, posts, participants)
-            for team_id in teams["team_id"]
+            self.get_team_overview(
+                team,
+                posts_by_team.get(team["team_id"], no_posts),
+                participant_names,
+                spent,
+            )
+            for team in teams.to_dict("records")
         ]
 
         return teams_info
 
+    @cached_query("teams", "team_scores", "participants", "accounts")
+    def get_leaderboard(self, limit=None, member_names=False):
+        # teams sorted by their points, read from the materialized `team_scores`
+        query = """
+            SELECT teams.*,
+                COALESCE(team_scores.points, 0) AS points,
+                COALESCE(team_scores.challenge, 0) AS challenge,
+                COALESCE(team_scores.checkpoint, 0) AS checkpoint,
+                COALESCE(team_scores.story, 0) AS story,
+                COALESCE(team_scores.spent, 0) AS spent
+            FROM teams
+            LEFT JOIN team_scores ON team_scores.team_id = teams.team_id
+            ORDER BY points DESC
+        """
+        params = ()
+
+        if limit is not None:
+            query += " LIMIT ?"
+            params = (limit,)
+
+        leaderboard = pd.read_sql_query(query, self.conn, params=params)
+
+        if not self.event.get("budget_per_person"):
+            leaderboard["spent"] = None
+
+        if member_names and not leaderboard.empty:
+            participants = self.get_participants(
+                include_non_registered=True, sort_by_name=False
+            )
+            participant_names = (
+                dict(zip(participants["id"], participants["name"]))
+                if not participants.empty
+                else {}
+            )
+
+            for member in ["member1", "member2", "member3"]:
+                leaderboard[f"{member}_name"] = leaderboard[member].apply(
+                    lambda x: participant_names.get(x, "") if x else ""
+                )
+
+        return leaderboard
+
+    def rebuild_team_scores(self):
+        self.write(scores.refresh_team_scores, tables=["team_scores"])
+        utils.log("Rebuilt team scores", level="info")
+
     def get_posts(
         self, team_filter=None, challenge_filter=None, checkpoint_filter=None
     ):
@@ -1330,16 +2022,160 @@ class Database:
         posts = posts.to_dict("records")
         return posts
 
-    def update_post_comment(self, post_id, comment):
-        self.conn.execute(
-            "UPDATE posts SET comment = ? WHERE post_id = ?", (comment, post_id)
+    def get_posts_feed_conditions(
+        self, team_filter=None, challenge_filter=None, checkpoint_filter=None
+    ):
+        conditions = []
+        params = []
+
+        if team_filter:
+            conditions.append("teams.team_name = ?")
+            params.append(team_filter)
+
+        if challenge_filter:
+            conditions.append("posts.action_name = ?")
+            params.append(challenge_filter)
+
+        if checkpoint_filter:
+            conditions.append("posts.action_name = ?")
+            params.append(checkpoint_filter)
+
+        return conditions, params
+
+    def get_posts_feed_cursor(
+        self,
+        team_filter=None,
+        challenge_filter=None,
+        checkpoint_filter=None,
+        page=0,
+        page_size=10,
+    ):
+        # id of the post which the given page of the feed follows (for `get_posts_feed(after=...)`),
+        # None for the first page or a page past the end of the feed
+        # used only for jumping to a page, paging forward and backward goes from the current page
+        if page <= 0:
+            return None
+
+        conditions, params = self.get_posts_feed_conditions(
+            team_filter, challenge_filter, checkpoint_filter
+        )
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        query = (
+            "SELECT posts.post_id FROM posts JOIN teams ON teams.team_id = posts.team_id"
+            f"{where} ORDER BY posts.created DESC, posts.post_id DESC LIMIT 1 OFFSET ?"
         )
-        self.conn.commit()
+        row = self.conn.execute(query, params + [page * page_size - 1]).fetchone()
+
+        return row[0] if row else None
+
+    @cached_query("posts", "teams")
+    def get_posts_feed(
+        self,
+        team_filter=None,
+        challenge_filter=None,
+        checkpoint_filter=None,
+        page_size=10,
+        after=None,
+        before=None,
+    ):
+        # a page of posts sorted from the newest, together with the total number of posts matching the filters
+        # `after` / `before` are ids of the posts which the page follows / precedes (keyset pagination),
+        # so that the cost of a page does not depend on how deep in the feed it is
+        conditions, params = self.get_posts_feed_conditions(
+            team_filter, challenge_filter, checkpoint_filter
+        )
+        join = "FROM posts JOIN teams ON teams.team_id = posts.team_id"
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+
+        query = f"SELECT COUNT(*) {join}{where}"
+        total = self.conn.execute(query, params).fetchone()[0]
+
+        cursor_id = after or before
+        cursor = None
+
+        if cursor_id:
+            cursor = self.conn.execute(
+                "SELECT created, post_id FROM posts WHERE post_id = ?", (cursor_id,)
+            ).fetchone()
+
+        # a cursor pointing to a deleted post starts from the beginning
+        if cursor and after:
+            conditions.append("(posts.created, posts.post_id) < (?, ?)")
+            params.extend(cursor)
+            order = "DESC"
+        elif cursor and before:
+            conditions.append("(posts.created, posts.post_id) > (?, ?)")
+            params.extend(cursor)
+            order = "ASC"
+        else:
+            order = "DESC"
+
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        query = (
+            f"SELECT posts.*, teams.team_name, teams.is_top_x {join}{where}"
+            f" ORDER BY posts.created {order}, posts.post_id {order} LIMIT ?"
+        )
+        params.append(page_size)
+
+        posts = [dict(post) for post in self.conn.execute(query, params)]
+
+        if order == "ASC":
+            posts.reverse()
+
+        for post in posts:
+            post["files"] = json.loads(post["files"])
+
+        return posts, total
+
+    def search(self, query, kinds=None, limit=20):
+        # full-text search over posts, teams and participants, see `search.py`
+        results = search.search(self.conn, query, kinds=kinds, limit=limit)
+
+        # posts are shown together with the team name
+        post_ids = [result["ref_id"] for result in results if result["kind"] == "post"]
+
+        if post_ids:
+            placeholders = ", ".join("?" for _ in post_ids)
+            query = f"SELECT posts.post_id, teams.team_name FROM posts JOIN teams ON teams.team_id = posts.team_id WHERE posts.post_id IN ({placeholders})"
+            team_names = dict(self.conn.execute(query, post_ids).fetchall())
+
+            for result in results:
+                if result["kind"] == "post":
+                    result["team_name"] = team_names.get(result["ref_id"])
+
+        return results
+
+    def get_random_posts(self, count):
+        query = "SELECT posts.*, teams.team_name, teams.is_top_x FROM posts JOIN teams ON teams.team_id = posts.team_id ORDER BY RANDOM() LIMIT ?"
+        posts = [dict(post) for post in self.conn.execute(query, (count,))]
+
+        for post in posts:
+            post["files"] = json.loads(post["files"])
+
+        return posts
+
+    def update_post_comment(self, post_id, comment):
+        def update(conn):
+            conn.execute(
+                "UPDATE posts SET comment = ? WHERE post_id = ?", (comment, post_id)
+            )
+            search.refresh_search_index(conn, "post", [post_id])
+
+        self.write(update, tables=["posts"])
         utils.log(f"Updated comment for post {post_id}", level="info")
 
     def delete_post(self, post_id):
-        self.conn.execute("DELETE FROM posts WHERE post_id = ?", (post_id,))
-        self.conn.commit()
+        def delete(conn):
+            post = conn.execute(
+                "SELECT team_id FROM posts WHERE post_id = ?", (post_id,)
+            ).fetchone()
+            conn.execute("DELETE FROM posts WHERE post_id = ?", (post_id,))
+            search.refresh_search_index(conn, "post", [post_id])
+
+            if post:
+                scores.refresh_team_scores(conn, [post["team_id"]])
+
+        self.write(delete, tables=["posts", "team_scores"])
 
     def get_available_actions(self, user, action_type):
         # retrieve actions (of type "challenge", etc.) which the user has not yet completed
@@ -1376,6 +2212,7 @@ class Database:
 
         return available_actions
 
+    @cached_query("teams")
     def get_teams(self):
         # retrieve all teams from the database, return as pandas df
         return pd.read_sql_query("SELECT * FROM teams", self.conn)
@@ -1453,162 +2290,60 @@ class Database:
         if team_photo:
             photo_dir = os.path.join(self.top_dir, "teams", slugify(team_name))
 
-            photo_content, photo_name = utils.postprocess_uploaded_photo(team_photo)
-
-            photo_path = os.path.join(photo_dir, photo_name)
-            self.write_file(filepath=photo_path, content=photo_content)
+            photo_path = self.ingest_photo(team_photo, photo_dir)
         else:
             # if photo already exists in the database, keep it
             if current_team:
                 photo_path = current_team["team_photo"]
 
         if not current_team:
-            self.conn.execute(
-                f"INSERT INTO teams (team_id, team_name, team_motto, team_description, team_web, team_photo, member1, member2, member3, is_top_x) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                (
-                    team_id,
-                    team_name,
-                    team_motto,
-                    team_description,
-                    team_web,
-                    photo_path,
-                    first_member,
-                    second_member,
-                    third_member,
-                    is_top_x,
-                ),
-            )
-            self.conn.commit()
+
+            def insert_team(conn):
+                conn.execute(
+                    f"INSERT INTO teams (team_id, team_name, team_motto, team_description, team_web, team_photo, member1, member2, member3, is_top_x) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        team_id,
+                        team_name,
+                        team_motto,
+                        team_description,
+                        team_web,
+                        photo_path,
+                        first_member,
+                        second_member,
+                        third_member,
+                        is_top_x,
+                    ),
+                )
+                scores.refresh_team_scores(conn, [team_id])
+                search.refresh_search_index(conn, "team", [team_id])
+
+            self.write(insert_team, tables=["teams", "team_scores"])
             utils.log(f"Added team {team_name}", level="success")
         else:
             # only update new values, keep the existing
-            self.conn.execute(
-                f"UPDATE teams SET team_name = ?, team_motto = ?, team_description = ?, team_web = ?, team_photo = ?, member1 = ?, member2 = ?, member3 = ?, is_top_x = ? WHERE team_id = ?",
-                (
-                    team_name,
-                    team_motto,
-                    team_description,
-                    team_web,
-                    photo_path,
-                    first_member,
-                    second_member,
-                    third_member,
-                    is_top_x if is_top_x else current_team["is_top_x"],
-                    team_id,
-                ),
-            )
-            self.conn.commit()
-            utils.log(f"Updated team {team_name}", level="info")
+            def update_team(conn):
+                conn.execute(
+                    f"UPDATE teams SET team_name = ?, team_motto = ?, team_description = ?, team_web = ?, team_photo = ?, member1 = ?, member2 = ?, member3 = ?, is_top_x = ? WHERE team_id = ?",
+                    (
+                        team_name,
+                        team_motto,
+                        team_description,
+                        team_web,
+                        photo_path,
+                        first_member,
+                        second_member,
+                        third_member,
+                        is_top_x if is_top_x else current_team["is_top_x"],
+                        team_id,
+                    ),
+                )
+                search.refresh_search_index(conn, "team", [team_id])
 
-    def create_tables(self):
-        self.conn.execute(
-            """CREATE TABLE if not exists participants (
-                id text not null unique,
-                email text not null unique,
-                name_web text not null,
-                bio text,
-                emergency_contact text,
-                photo text,
-                primary key(id)       
-            );"""
-        )
-        self.conn.execute(
-            """CREATE TABLE if not exists teams (
-                team_id text not null unique,
-                team_name text not null,
-                member1 text not null,
-                member2 text,
-                member3 text,
-                team_motto text,
-                team_description text,
-                team_web text,
-                team_photo text,
-                is_top_x integer default 0,
-                location_visibility integer default 1,
-                location_color text,
-                location_icon_color text,
-                location_icon text,
-                award text,
-                primary key(team_id)   
-            );"""
-        )
-        self.conn.execute(
-            """CREATE TABLE if not exists posts (
-                post_id text not null unique,
-                pax_id text not null,
-                team_id text,
-                action_id text,
-                action_type text not null,
-                action_name text not null,
-                comment text,
-                created text not null,
-                files text,
-                flags text,
-                primary key(post_id),
-                CONSTRAINT unique_post_entry UNIQUE (action_name, action_type, team_id)
-            );"""
-        )
-        self.conn.execute(
-            """CREATE TABLE if not exists locations (
-                username text not null,
-                team_id text not null,
-                comment text,
-                longitude float not null,
-                latitude float not null,
-                accuracy text,
-                altitude text,
-                altitude_accuracy text,
-                heading text,
-                speed text,
-                address text,
-                date text not null
-            );"""
-        )
-        self.conn.execute(
-            """CREATE TABLE if not exists challenges (
-                id text not null unique,
-                name text not null,
-                description text not null,
-                category text not null,
-                points int not null,
-                primary key(name)       
-            );"""
-        )
-        self.conn.execute(
-            """CREATE TABLE if not exists checkpoints (
-                id text not null unique,
-                name text not null,
-                description text not null,
-                points int not null,
-                latitude float,
-                longitude float,
-                challenge text,
-                points_challenge int,
-                primary key(name)       
-            );"""
-        )
-        self.conn.execute(
-            """CREATE TABLE if not exists notifications (
-                id text not null unique,
-                name text,
-                text text not null,
-                type text
-            );"""
-        )
+            self.write(update_team, tables=["teams"])
+            utils.log(f"Updated team {team_name}", level="info")
 
-        self.conn.execute(
-            """
-            CREATE TABLE if not exists budget (
-                id TEXT PRIMARY KEY,
-                team_id TEXT NOT NULL,
-                amount INTEGER NOT NULL,
-                amount_czk INTEGER NOT NULL,
-                description TEXT,
-                category TEXT NOT NULL,
-                currency TEXT NOT NULL,
-                date TEXT NOT NULL
-            );"""
-        )
+    def upgrade_schema(self):
+        self.write(migrations.migrate)
 
     def get_address(self, latitude, longitude):
         try:
@@ -1647,7 +2382,7 @@ class Database:
         username = user["username"]
         team_id = str(team["team_id"])
 
-        self.conn.execute(
+        self.execute_write(
             f"INSERT INTO locations (username, team_id, comment, longitude, latitude, accuracy, altitude, altitude_accuracy, heading, speed, address, date) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
             (
                 username,
@@ -1663,8 +2398,8 @@ class Database:
                 address,
                 date,
             ),
+            tables=["locations"],
         )
-        self.conn.commit()
         # utils.log(f"Saved location {latitude}, {longitude} for {username}", level="success")
 
     def save_location_options(
@@ -1672,10 +2407,11 @@ class Database:
     ):
         team_id = str(team["team_id"])
 
-        self.conn.execute(
-            f"UPDATE teams SET location_color='{location_color}', location_icon_color='{location_icon_color}', location_icon='{location_icon}' WHERE team_id='{team_id}'"
+        self.execute_write(
+            "UPDATE teams SET location_color = ?, location_icon_color = ?, location_icon = ? WHERE team_id = ?",
+            (location_color, location_icon_color, location_icon, team_id),
+            tables=["teams"],
         )
-        self.conn.commit()
         utils.log(f"Updated location options for {team['team_name']}", level="info")
 
     def get_last_location(_self, team, for_datetime=None):
@@ -1684,21 +2420,16 @@ class Database:
         if not for_datetime:
             for_datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-        # df = pd.read_sql_query(
-        #     f"SELECT * FROM locations WHERE team_id='{team_id}' AND team_id='{team_id}' ORDER BY date DESC LIMIT 1",
-        #     _self.conn,
-        # )
-
         # select the last location for the given datetime
-        df = pd.read_sql_query(
-            f"SELECT * FROM locations WHERE team_id='{team_id}' AND date <= '{for_datetime}' ORDER BY date DESC LIMIT 1",
-            _self.conn,
-        )
+        location = _self.conn.execute(
+            "SELECT * FROM locations WHERE team_id = ? AND date <= ? ORDER BY date DESC LIMIT 1",
+            (team_id, for_datetime),
+        ).fetchone()
 
-        if df.empty:
+        if not location:
             return None
 
-        return df.to_dict("records")[0]
+        return dict(location)
 
     def get_locations_as_gpx(_self, team):
         team_id = team["team_id"]
@@ -1739,38 +2470,40 @@ class Database:
         return gpx.to_xml()
 
     def get_last_locations(_self, for_datetime=None):
-        # get last locations of all teams
-        teams = _self.get_table_as_df("teams")
-        last_locations = []
-
-        for _, team in teams.iterrows():
-            # get last location of the team
-            last_location = _self.get_last_location(team, for_datetime=for_datetime)
-
-            if last_location is None:
-                continue
-
-            if not _self.is_team_visible(team):
-                continue
+        # last locations of all visible teams in a single query, each location is looked up
+        # in the index `locations_team_date`
+        # the team columns needed for the map are included so that the callers do not need to fetch the teams
+        if not for_datetime:
+            for_datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-            last_locations.append(last_location)
+        query = """
+            SELECT locations.*, teams.team_name, COALESCE(teams.is_top_x, 0) AS is_top_x,
+                teams.location_color, teams.location_icon_color, teams.location_icon
+            FROM teams
+            JOIN locations ON locations.rowid = (
+                SELECT rowid FROM locations
+                WHERE locations.team_id = teams.team_id AND locations.date <= ?
+                ORDER BY locations.date DESC LIMIT 1
+            )
+            -- by mistake some records are NULL and not 1 by default, see `is_team_visible`
+            WHERE COALESCE(teams.location_visibility, 1) != 0
+        """
+        last_locations = pd.read_sql_query(query, _self.conn, params=(for_datetime,))
 
-        if not last_locations:
+        if last_locations.empty:
             return None
 
-        # create dataframe from the list of locations
-        last_locations = pd.DataFrame(last_locations)
-
         return last_locations
 
     def update_location_comment(self, location, comment):
         username = location["username"]
         date = location["date"]
 
-        self.conn.execute(
-            f"UPDATE locations SET comment='{comment}' WHERE username='{username}' AND date='{date}'"
+        self.execute_write(
+            "UPDATE locations SET comment = ? WHERE username = ? AND date = ?",
+            (comment, username, date),
+            tables=["locations"],
         )
-        self.conn.commit()
 
         utils.log(f"Updated location {username} {date}", level="info")
 
@@ -1778,10 +2511,11 @@ class Database:
         username = location["username"]
         date = location["date"]
 
-        self.conn.execute(
-            f"DELETE FROM locations WHERE username='{username}' AND date='{date}'"
+        self.execute_write(
+            "DELETE FROM locations WHERE username = ? AND date = ?",
+            (username, date),
+            tables=["locations"],
         )
-        self.conn.commit()
 
         utils.log(f"Deleted location {username} {date}", level="info")
 
@@ -1809,8 +2543,12 @@ class Database:
         return bool(is_top_x)
 
     def delete_team(self, team_id):
-        self.conn.execute("DELETE FROM teams WHERE team_id = ?", (team_id,))
-        self.conn.commit()
+        def delete(conn):
+            conn.execute("DELETE FROM teams WHERE team_id = ?", (team_id,))
+            conn.execute("DELETE FROM team_scores WHERE team_id = ?", (team_id,))
+            search.refresh_search_index(conn, "team", [team_id])
+
+        self.write(delete, tables=["teams", "team_scores"])
         utils.log(f"Deleted team {team_id}", level="info")
 
     def get_fa_icons(self):
@@ -1856,20 +2594,23 @@ class Database:
 
         spending_id = utils.generate_uuid()
 
-        self.conn.execute(
-            f"INSERT INTO budget (id, team_id, amount, amount_czk, description, currency, category, date) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-            (
-                spending_id,
-                team_id,
-                amount,
-                amount_czk,
-                comment,
-                currency,
-                category,
-                date,
-            ),
-        )
-        self.conn.commit()
+        def insert_spending(conn):
+            conn.execute(
+                f"INSERT INTO budget (id, team_id, amount, amount_czk, description, currency, category, date) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    spending_id,
+                    team_id,
+                    amount,
+                    amount_czk,
+                    comment,
+                    currency,
+                    category,
+                    date,
+                ),
+            )
+            scores.refresh_team_scores(conn, [team_id])
+
+        self.write(insert_spending, tables=["budget", "team_scores"])
         utils.log(
             f"Added spending {amount} {currency} for {team['team_name']}",
             level="success",
@@ -1888,8 +2629,16 @@ class Database:
         return spendings
 
     def delete_spending(self, spending_id):
-        self.conn.execute(f"DELETE FROM budget WHERE id='{spending_id}'")
-        self.conn.commit()
+        def delete(conn):
+            spending = conn.execute(
+                "SELECT team_id FROM budget WHERE id = ?", (spending_id,)
+            ).fetchone()
+            conn.execute("DELETE FROM budget WHERE id = ?", (spending_id,))
+
+            if spending:
+                scores.refresh_team_scores(conn, [spending["team_id"]])
+
+        self.write(delete, tables=["budget", "team_scores"])
         utils.log(f"Deleted spending {spending_id}", level="info")
 
     def update_spending(self, spending, spending_type, comment):
@@ -1901,10 +2650,15 @@ class Database:
             spending["amount_czk"] = abs(spending["amount_czk"])
 
         spending_id = spending["id"]
-        self.conn.execute(
-            f"UPDATE budget SET amount={spending['amount']}, amount_czk={spending['amount_czk']}, description='{comment}' WHERE id='{spending_id}'"
-        )
-        self.conn.commit()
+
+        def update(conn):
+            conn.execute(
+                "UPDATE budget SET amount = ?, amount_czk = ?, description = ? WHERE id = ?",
+                (spending["amount"], spending["amount_czk"], comment, spending_id),
+            )
+            scores.refresh_team_scores(conn, [spending["team_id"]])
+
+        self.write(update, tables=["budget", "team_scores"])
         utils.log(f"Updated spending {spending_id}", level="info")
 
     def get_team_link(self, team):
@@ -1938,10 +2692,11 @@ class Database:
 
         visibility = 1 - visibility
 
-        self.conn.execute(
-            f"UPDATE teams SET location_visibility={visibility} WHERE team_id='{team_id}'",
+        self.execute_write(
+            "UPDATE teams SET location_visibility = ? WHERE team_id = ?",
+            (visibility, team_id),
+            tables=["teams"],
         )
-        self.conn.commit()
 
         return visibility
 
@@ -1953,13 +2708,15 @@ if __name__ == "__main__":
     parser.add_argument("-f", "--load_from_local_file", type=str)
     parser.add_argument("--fill_addresses", action="store_true")
     parser.add_argument("--reslugify", action="store_true")
+    parser.add_argument("--rebuild_scores", action="store_true")
+    parser.add_argument("--normalize_photos", action="store_true")
 
     args = parser.parse_args()
 
     print(args)
     print("Creating database...")
     db = Database()
-    db.create_tables()
+    db.upgrade_schema()
 
     if args.load_from_wc_product:
         print("Fetching participants from Woocommerce...")
@@ -1984,15 +2741,21 @@ if __name__ == "__main__":
             if row["address"] == None:
                 print(dict(row))
                 location = geoLoc.reverse(f"{row['latitude']}, {row['longitude']}")
-                db.conn.execute(
+                db.execute_write(
                     """UPDATE locations
                     SET address = ?
                     WHERE team_id = ? AND date = ?;
                     """,
                     (location.address, row["team_id"], row["date"]),
+                    tables=["locations"],
                 )
-                db.conn.commit()
                 print(location.address)
+    elif args.rebuild_scores:
+        print("Rebuilding team scores...")
+        db.rebuild_team_scores()
+    elif args.normalize_photos:
+        print("Normalizing photos...")
+        db.normalize_photos()
     elif args.reslugify:
         # hotfix - we forgot to slugify folders
         for i, row in db.get_table_as_df("posts").iterrows():
@@ -2019,11 +2782,11 @@ if __name__ == "__main__":
                     db.delete_file(path)
 
             # update `files` as new_files in db
-            db.conn.execute(
+            db.execute_write(
                 """UPDATE posts
                 SET files = ?
                 WHERE post_id = ?;
                 """,
                 (json.dumps(new_files), row["post_id"]),
+                tables=["posts"],
             )
-            db.conn.commit()
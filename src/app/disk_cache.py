@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+
+from connections import ConnectionManager
+
+import hashlib
+import os
+import threading
+import time
+import utils
+
+# shared by all the events (the S3 keys contain the event)
+DISK_CACHE_DIR = os.path.join("cache", "s3")
+
+# used if the budget is not set in the settings (`disk_cache_mb`)
+DEFAULT_MAX_BYTES = 2048 * 1024 * 1024
+
+# cached files older than this (in seconds) are revalidated against S3 using their ETag,
+# the files written by the app itself are updated in the cache right away
+REVALIDATE_AFTER = 3600
+
+
+def create_tables(conn):
+    conn.execute(
+        """CREATE TABLE if not exists entries (
+            path text not null,
+            filename text not null,
+            etag text,
+            size integer not null,
+            accessed real not null,
+            validated real not null,
+            primary key(path)
+        );"""
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+
+
+class DiskCache:
+    # Read-through cache of the files stored in S3 on the local disk, so that the hot files
+    # (mostly thumbnails) are not downloaded over and over again, even after a restart.
+    # The index (index.db in the cache directory) keeps the ETag, size and last access of every file,
+    # the least recently used files are evicted once the total size exceeds `max_bytes`.
+
+    def __init__(self, cache_dir=DISK_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.connections = ConnectionManager(os.path.join(cache_dir, "index.db"))
+        self.connections.write(create_tables).result()
+
+    def get_filename(self, path):
+        # the S3 keys are hashed so that they are safe to use as file names
+        digest = hashlib.sha1(path.encode("utf-8")).hexdigest()
+        return os.path.join(digest[:2], digest)
+
+    def get(self, path):
+        # returns {"content", "etag", "validated"} or None if the file is not cached
+        row = (
+            self.connections.get()
+            .execute(
+                "SELECT filename, etag, validated FROM entries WHERE path = ?", (path,)
+            )
+            .fetchone()
+        )
+
+        if row is None:
+            return None
+
+        try:
+            with open(os.path.join(self.cache_dir, row["filename"]), "rb") as f:
+                content = f.read()
+        except OSError:
+            # evicted in the meantime or removed by hand
+            self.invalidate(path)
+            return None
+
+        # no need to wait for the access time to be stored
+        self.connections.write(
+            lambda conn: conn.execute(
+                "UPDATE entries SET accessed = ? WHERE path = ?", (time.time(), path)
+            )
+        )
+
+        return {"content": content, "etag": row["etag"], "validated": row["validated"]}
+
+    def is_fresh(self, entry):
+        return time.time() - entry["validated"] < REVALIDATE_AFTER
+
+    def put(self, path, content, etag):
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+
+        if len(content) > self.max_bytes:
+            return
+
+        filename = self.get_filename(path)
+        filepath = os.path.join(self.cache_dir, filename)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+
+        # write to a temporary file first so that the readers never see a partially written file
+        tmp_filepath = f"{filepath}.{threading.get_ident()}.tmp"
+
+        with open(tmp_filepath, "wb") as f:
+            f.write(content)
+
+        os.replace(tmp_filepath, filepath)
+
+        def insert(conn):
+            now = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (path, filename, etag, size, accessed, validated) VALUES (?, ?, ?, ?, ?, ?)",
+                (path, filename, etag, len(content), now, now),
+            )
+            self.evict(conn)
+
+        self.connections.write(insert)
+
+    def evict(self, conn):
+        size = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+        if size <= self.max_bytes:
+            return
+
+        evicted = []
+
+        for row in conn.execute(
+            "SELECT path, filename, size FROM entries ORDER BY accessed"
+        ).fetchall():
+            if size <= self.max_bytes:
+                break
+
+            evicted.append((row["path"],))
+            size -= row["size"]
+            self.remove_file(row["filename"])
+
+        conn.executemany("DELETE FROM entries WHERE path = ?", evicted)
+        utils.log(f"Evicted {len(evicted)} files from the disk cache", level="debug")
+
+    def remove_file(self, filename):
+        try:
+            os.remove(os.path.join(self.cache_dir, filename))
+        except OSError:
+            pass
+
+    def mark_validated(self, path):
+        self.connections.write(
+            lambda conn: conn.execute(
+                "UPDATE entries SET validated = ? WHERE path = ?", (time.time(), path)
+            )
+        )
+
+    def invalidate(self, path):
+        def delete(conn):
+            # the file is removed in the writer thread, so that it cannot race with a `put()` of the same path
+            if conn.execute("SELECT 1 FROM entries WHERE path = ?", (path,)).fetchone():
+                conn.execute("DELETE FROM entries WHERE path = ?", (path,))
+                self.remove_file(self.get_filename(path))
+
+        self.connections.write(delete).result()
+
+    def set_max_bytes(self, max_bytes):
+        self.max_bytes = max_bytes
+
+    def get_stats(self):
+        row = (
+            self.connections.get()
+            .execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries")
+            .fetchone()
+        )
+
+        return {
+            "entries": row[0],
+            "size_mb": round(row[1] / 1024 / 1024, 1),
+            "max_size_mb": round(self.max_bytes / 1024 / 1024, 1),
+        }
+
+    def close(self):
+        self.connections.close()
+
+
+disk_cache = None
+disk_cache_lock = threading.Lock()
+
+
+def get_disk_cache():
+    global disk_cache
+
+    with disk_cache_lock:
+        if disk_cache is None:
+            disk_cache = DiskCache()
+
+        return disk_cache
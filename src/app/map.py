@@ -48,13 +48,15 @@ def show_positions(db):
         attr="<a href=https:/stamen.com/>Stamen.com</a>",
     )
 
+    icons = db.get_fa_icons()
+
+    # the locations include the team columns needed for the markers
     for _, location in last_locations.iterrows():
-        team = db.get_team_by_id(location["team_id"])
-        team_icon = team["location_icon"] or "user"
-        team_color = team["location_color"] or "red"
-        team_icon_color = team["location_icon_color"] or "white"
+        team_icon = location["location_icon"] or "user"
+        team_color = location["location_color"] or "red"
+        team_icon_color = location["location_icon_color"] or "white"
 
-        team_name = team["team_name"]
+        team_name = location["team_name"]
         date = location["date"]
         ago_str = utils.ago(date)
         # ago_str = date
@@ -68,7 +70,6 @@ def show_positions(db):
 
         popup += f"<i>{ago_str}</i>"
 
-        icons = db.get_fa_icons()
         icon_type = icons.get(team_icon, "fa-solid")
 
         folium.Marker(
@@ -97,10 +98,7 @@ def show_last_shared_locations(db, last_locations):
     st.subheader("Nedávné aktualizace")
 
     for _, location in last_locations.head(5).iterrows():
-        team = db.get_team_by_id(location["team_id"])
-        # team_name = team["team_name"]
-
-        team_link = db.get_team_link(team)
+        team_link = db.get_team_link(location)
 
         date = location["date"]
         ago_str = utils.ago(date)
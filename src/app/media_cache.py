@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+from collections import OrderedDict
+
+import threading
+
+# used if the budget is not set in the settings (`media_cache_mb`)
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# files larger than this fraction of the budget (typically videos) are not cached
+# so that a single file cannot flush all the thumbnails
+MAX_ENTRY_FRACTION = 0.1
+
+
+class MediaCache:
+    # In-memory LRU cache of the encoded contents of media files (images, thumbnails, videos),
+    # keyed by (path, thumbnail size). The total size of the cached files is kept under `max_bytes`.
+    # Holding the encoded bytes instead of PIL images keeps the memory usage predictable.
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, path, thumbnail=None):
+        key = (path, thumbnail)
+
+        with self.lock:
+            content = self.entries.get(key)
+
+            if content is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return content
+
+    def put(self, path, content, thumbnail=None):
+        if not content or len(content) > self.max_bytes * MAX_ENTRY_FRACTION:
+            return
+
+        key = (path, thumbnail)
+
+        with self.lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key))
+
+            self.entries[key] = content
+            self.size += len(content)
+            self.evict()
+
+    def evict(self):
+        while self.size > self.max_bytes and self.entries:
+            _, content = self.entries.popitem(last=False)
+            self.size -= len(content)
+            self.evictions += 1
+
+    def invalidate(self, path):
+        # all the cached versions of the file (e.g. after it was overwritten or deleted)
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == path]:
+                self.size -= len(self.entries.pop(key))
+
+    def set_max_bytes(self, max_bytes):
+        with self.lock:
+            self.max_bytes = max_bytes
+            self.evict()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def get_stats(self):
+        with self.lock:
+            requests = self.hits + self.misses
+
+            return {
+                "entries": len(self.entries),
+                "size_mb": round(self.size / 1024 / 1024, 1),
+                "max_size_mb": round(self.max_bytes / 1024 / 1024, 1),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / requests, 3) if requests else None,
+                "evictions": self.evictions,
+            }
+
+
+media_cache = None
+media_cache_lock = threading.Lock()
+
+
+def get_media_cache():
+    # a single cache shared by the databases of all the events (the paths contain the event)
+    global media_cache
+
+    with media_cache_lock:
+        if media_cache is None:
+            media_cache = MediaCache()
+
+        return media_cache
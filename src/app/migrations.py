@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+
+# Versioned schema migrations for the event databases (db/<event>/database.db).
+# The schema version of each database is kept in `PRAGMA user_version`, migrations
+# with a higher number are applied in order when the database is opened.
+#
+# To change the schema, append a new function to `MIGRATIONS` (never edit the existing ones).
+# All the event databases can be upgraded at once by running `python migrations.py`.
+
+from connections import ConnectionManager
+
+import glob
+import os
+import scores
+import search
+import thumbnails
+import utils
+
+# columns which were added to the tables over the years, older databases may miss them
+ADDED_COLUMNS = {
+    "teams": [
+        ("member3", "text"),
+        ("team_description", "text"),
+        ("is_top_x", "integer default 0"),
+        ("location_visibility", "integer default 1"),
+        ("location_color", "text"),
+        ("location_icon_color", "text"),
+        ("location_icon", "text"),
+        ("award", "text"),
+    ],
+    "posts": [
+        ("action_id", "text"),
+        ("flags", "text"),
+    ],
+    "checkpoints": [
+        ("challenge", "text"),
+        ("points_challenge", "int"),
+    ],
+}
+
+
+def create_tables(conn):
+    conn.execute(
+        """CREATE TABLE if not exists participants (
+            id text not null unique,
+            email text not null unique,
+            name_web text not null,
+            bio text,
+            emergency_contact text,
+            photo text,
+            primary key(id)       
+        );"""
+    )
+    conn.execute(
+        """CREATE TABLE if not exists teams (
+            team_id text not null unique,
+            team_name text not null,
+            member1 text not null,
+            member2 text,
+            member3 text,
+            team_motto text,
+            team_description text,
+            team_web text,
+            team_photo text,
+            is_top_x integer default 0,
+            location_visibility integer default 1,
+            location_color text,
+            location_icon_color text,
+            location_icon text,
+            award text,
+            primary key(team_id)   
+        );"""
+    )
+    conn.execute(
+        """CREATE TABLE if not exists posts (
+            post_id text not null unique,
+            pax_id text not null,
+            team_id text,
+            action_id text,
+            action_type text not null,
+            action_name text not null,
+            comment text,
+            created text not null,
+            files text,
+            flags text,
+            primary key(post_id),
+            CONSTRAINT unique_post_entry UNIQUE (action_name, action_type, team_id)
+        );"""
+    )
+    conn.execute(
+        """CREATE TABLE if not exists locations (
+            username text not null,
+            team_id text not null,
+            comment text,
+            longitude float not null,
+            latitude float not null,
+            accuracy text,
+            altitude text,
+            altitude_accuracy text,
+            heading text,
+            speed text,
+            address text,
+            date text not null
+        );"""
+    )
+    conn.execute(
+        """CREATE TABLE if not exists challenges (
+            id text not null unique,
+            name text not null,
+            description text not null,
+            category text not null,
+            points int not null,
+            primary key(name)       
+        );"""
+    )
+    conn.execute(
+        """CREATE TABLE if not exists checkpoints (
+            id text not null unique,
+            name text not null,
+            description text not null,
+            points int not null,
+            latitude float,
+            longitude float,
+            challenge text,
+            points_challenge int,
+            primary key(name)       
+        );"""
+    )
+    conn.execute(
+        """CREATE TABLE if not exists notifications (
+            id text not null unique,
+            name text,
+            text text not null,
+            type text
+        );"""
+    )
+
+    conn.execute(
+        """
+        CREATE TABLE if not exists budget (
+            id TEXT PRIMARY KEY,
+            team_id TEXT NOT NULL,
+            amount INTEGER NOT NULL,
+            amount_czk INTEGER NOT NULL,
+            description TEXT,
+            category TEXT NOT NULL,
+            currency TEXT NOT NULL,
+            date TEXT NOT NULL
+        );"""
+    )
+
+
+def add_missing_columns(conn):
+    for table, columns in ADDED_COLUMNS.items():
+        existing = [row["name"] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+        for column, column_type in columns:
+            if column not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+
+def create_indexes(conn):
+    # get_team_for_user: `member1 = ? OR member2 = ? OR member3 = ?` is answered by a union of three index lookups
+    conn.execute("CREATE INDEX IF NOT EXISTS teams_member1 ON teams (member1)")
+    conn.execute("CREATE INDEX IF NOT EXISTS teams_member2 ON teams (member2)")
+    conn.execute("CREATE INDEX IF NOT EXISTS teams_member3 ON teams (member3)")
+
+    # get_posts_by_team, feed of a single team (sorted by creation time)
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS posts_team_created ON posts (team_id, created)"
+    )
+    # get_last_location(s): latest location of a team before a given date
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS locations_team_date ON locations (team_id, date)"
+    )
+    # get_participant_by_email, is_participant: case-insensitive e-mail lookups
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS participants_email_lower ON participants (LOWER(email))"
+    )
+    # get_spendings_by_team
+    conn.execute("CREATE INDEX IF NOT EXISTS budget_team ON budget (team_id)")
+
+
+def create_feed_index(conn):
+    # get_posts_feed: keyset pagination over the whole feed (newest first)
+    conn.execute("CREATE INDEX IF NOT EXISTS posts_created ON posts (created, post_id)")
+
+
+def create_team_scores(conn):
+    scores.create_team_scores_table(conn)
+    scores.refresh_team_scores(conn)
+
+
+def create_search_index(conn):
+    search.create_search_index_table(conn)
+    search.refresh_all(conn)
+
+
+def create_media_manifest(conn):
+    # filled lazily, see `Database.read_thumbnail`
+    thumbnails.create_media_table(conn)
+
+
+def add_media_content_hash(conn):
+    conn.execute("ALTER TABLE media ADD COLUMN content_hash text")
+
+
+def add_media_normalized(conn):
+    conn.execute("ALTER TABLE media ADD COLUMN normalized integer")
+
+
+MIGRATIONS = [
+    create_tables,
+    add_missing_columns,
+    create_indexes,
+    create_team_scores,
+    create_feed_index,
+    create_search_index,
+    create_media_manifest,
+    add_media_content_hash,
+    add_media_normalized,
+]
+
+
+def get_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    # expected to run in a transaction, i.e. either all pending migrations are applied or none
+    version = get_version(conn)
+
+    for i, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        migration(conn)
+        conn.execute(f"PRAGMA user_version = {i}")
+
+    return version, len(MIGRATIONS)
+
+
+def migrate_all(db_dir="db"):
+    for db_path in sorted(glob.glob(os.path.join(db_dir, "*", "database.db"))):
+        connections = ConnectionManager(db_path)
+        old_version, new_version = connections.write(migrate).result()
+        connections.close()
+
+        if old_version != new_version:
+            utils.log(
+                f"Upgraded {db_path} from version {old_version} to {new_version}",
+                level="info",
+            )
+
+
+if __name__ == "__main__":
+    migrate_all()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+# Scoring of the posts and the materialized per-team scores (table `team_scores`).
+# The table is updated by the writes which can change the score of a team (see `refresh_team_scores`),
+# so that the leaderboard does not have to compute the points on every render.
+
+# points for each post, the action is matched by `action_id`
+# older posts without it are matched by the prefix of the action name (see `Database.get_action`)
+POST_POINTS_QUERY = """
+    SELECT posts.*,
+        CASE posts.action_type
+            WHEN 'challenge' THEN COALESCE(challenges.points, 0)
+            WHEN 'checkpoint' THEN COALESCE(checkpoints.points, 0) + (
+                CASE WHEN posts.flags LIKE :challenge_completed
+                THEN COALESCE(checkpoints.points_challenge, 0) ELSE 0 END
+            )
+            ELSE 0
+        END AS points
+    FROM posts
+    LEFT JOIN challenges ON posts.action_type = 'challenge' AND challenges.rowid = (
+        CASE WHEN COALESCE(posts.action_id, '') != ''
+        THEN (SELECT rowid FROM challenges WHERE id = posts.action_id)
+        ELSE (SELECT rowid FROM challenges WHERE name LIKE posts.action_name || '%' LIMIT 1)
+        END
+    )
+    LEFT JOIN checkpoints ON posts.action_type = 'checkpoint' AND checkpoints.rowid = (
+        CASE WHEN COALESCE(posts.action_id, '') != ''
+        THEN (SELECT rowid FROM checkpoints WHERE id = posts.action_id)
+        ELSE (SELECT rowid FROM checkpoints WHERE name LIKE posts.action_name || '%' LIMIT 1)
+        END
+    )
+"""
+
+# tables whose changes can affect the scores of any team
+SCORED_TABLES = ["teams", "posts", "challenges", "checkpoints", "budget"]
+
+# flags are stored as a string representation of a Python dict, see `Database.save_post`
+POST_POINTS_PARAMS = {"challenge_completed": "%'checkpoint_challenge_completed': True%"}
+
+
+def create_team_scores_table(conn):
+    conn.execute(
+        """CREATE TABLE if not exists team_scores (
+            team_id text not null,
+            points real not null default 0,
+            challenge integer not null default 0,
+            checkpoint integer not null default 0,
+            story integer not null default 0,
+            spent real not null default 0,
+            primary key(team_id)
+        );"""
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS team_scores_points ON team_scores (points DESC)"
+    )
+
+
+def refresh_team_scores(conn, team_ids=None):
+    # recomputes the scores of the given teams (all teams if `team_ids` is None)
+    # expected to run in the same transaction as the write which changed the score
+    params = dict(POST_POINTS_PARAMS)
+
+    if team_ids is None:
+        conn.execute("DELETE FROM team_scores")
+        posts_filter = ""
+        teams_filter = ""
+    else:
+        team_ids = [str(team_id) for team_id in team_ids if team_id is not None]
+
+        if not team_ids:
+            return
+
+        placeholders = ", ".join(f":team_{i}" for i in range(len(team_ids)))
+        params.update({f"team_{i}": team_id for i, team_id in enumerate(team_ids)})
+
+        conn.execute(
+            f"DELETE FROM team_scores WHERE team_id IN ({placeholders})", params
+        )
+        posts_filter = f"WHERE posts.team_id IN ({placeholders})"
+        teams_filter = f"WHERE teams.team_id IN ({placeholders})"
+
+    conn.execute(
+        f"""
+        WITH post_points AS ({POST_POINTS_QUERY} {posts_filter})
+        INSERT INTO team_scores (team_id, points, challenge, checkpoint, story, spent)
+        SELECT teams.team_id,
+            COALESCE(SUM(post_points.points), 0),
+            COUNT(CASE WHEN post_points.action_type = 'challenge' THEN 1 END),
+            COUNT(CASE WHEN post_points.action_type = 'checkpoint' THEN 1 END),
+            COUNT(CASE WHEN post_points.action_type = 'story' THEN 1 END),
+            (SELECT COALESCE(SUM(amount_czk), 0) FROM budget WHERE budget.team_id = teams.team_id)
+        FROM teams
+        LEFT JOIN post_points ON post_points.team_id = teams.team_id
+        {teams_filter}
+        GROUP BY teams.team_id
+        """,
+        params,
+    )
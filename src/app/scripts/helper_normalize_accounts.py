@@ -1,7 +1,13 @@
-import yaml
+import os
 import re
+import sys
 from unidecode import unidecode
 
+# run from the repository root (the accounts are stored in db/accounts.db)
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+from accounts import AccountStore
+
 
 def normalize_username(username):
     # Lowercase
@@ -18,31 +24,25 @@ def normalize_username(username):
     return username
 
 
-def normalize_yaml(yaml_file):
-    """Normalizes usernames in a YAML file."""
-    with open(yaml_file, "r") as f:
-        data = yaml.safe_load(f)
+def normalize_accounts(store):
+    """Normalizes usernames in the account store."""
+    usernames = store.get_accounts()["credentials"]["usernames"]
 
-    # update ["credentials"]["usernames"]
-    for username in list(data["credentials"]["usernames"].keys()):
-        # user = data["credentials"]["usernames"][username]
+    for username in list(usernames.keys()):
+        user = usernames[username]
         normalized_username = normalize_username(username)
 
-        if normalized_username != username:
-            data["credentials"]["usernames"][normalized_username] = data["credentials"][
-                "usernames"
-            ].pop(username)
-
-    for username in list(data["credentials"]["usernames"].keys()):
-        user = data["credentials"]["usernames"][username]
         if "username" in user:
-            # normalize_username
             user["username"] = normalize_username(user["username"])
 
-    with open(yaml_file, "w") as f:
-        yaml.dump(data, f, default_flow_style=False)
+        if normalized_username != username:
+            usernames[normalized_username] = usernames.pop(username)
+            store.rename_user(username, normalized_username, user)
+        elif "username" in user:
+            store.save_user(username, user)
+
+    store.close()
 
 
 # Example usage
-yaml_file = "../accounts.yaml"
-normalize_yaml(yaml_file)
+normalize_accounts(AccountStore())
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+# Full-text search over posts, teams and participants (FTS5 table `search_index`).
+# The indexed text is transliterated to lowercase ASCII with `unidecode`, so that
+# "cesky" matches "Český" and vice versa. The index is updated by the writes which change
+# the indexed columns (see `refresh_search_index`).
+
+from unidecode import unidecode
+
+import re
+
+# searchable documents: the table they come from, its id column, the columns with the title and the body
+SOURCES = {
+    "post": {
+        "table": "posts",
+        "id": "post_id",
+        "title": ["action_name"],
+        "body": ["comment"],
+    },
+    "team": {
+        "table": "teams",
+        "id": "team_id",
+        "title": ["team_name"],
+        "body": ["team_motto", "team_description"],
+    },
+    "participant": {
+        "table": "participants",
+        "id": "id",
+        "title": ["name_web"],
+        "body": ["bio"],
+    },
+}
+
+# source tables whose changes require refreshing the index
+INDEXED_TABLES = {source["table"]: kind for kind, source in SOURCES.items()}
+
+
+def normalize(text):
+    return unidecode(text or "").lower()
+
+
+def create_search_index_table(conn):
+    # `label` is the original (not normalized) title shown in the results
+    conn.execute(
+        """CREATE VIRTUAL TABLE if not exists search_index USING fts5(
+            kind UNINDEXED,
+            ref_id UNINDEXED,
+            label UNINDEXED,
+            title,
+            body
+        );"""
+    )
+
+
+def refresh_search_index(conn, kind, ref_ids=None):
+    # re-indexes the documents of the given kind with the given ids (all documents if `ref_ids` is None)
+    # expected to run in the same transaction as the write which changed them
+    source = SOURCES[kind]
+    columns = [source["id"]] + source["title"] + source["body"]
+    query = f"SELECT {', '.join(columns)} FROM {source['table']}"
+
+    if ref_ids is None:
+        conn.execute("DELETE FROM search_index WHERE kind = ?", (kind,))
+        rows = conn.execute(query).fetchall()
+    else:
+        ref_ids = [str(ref_id) for ref_id in ref_ids if ref_id is not None]
+
+        if not ref_ids:
+            return
+
+        placeholders = ", ".join("?" for _ in ref_ids)
+        conn.execute(
+            f"DELETE FROM search_index WHERE kind = ? AND ref_id IN ({placeholders})",
+            [kind] + ref_ids,
+        )
+        rows = conn.execute(
+            f"{query} WHERE {source['id']} IN ({placeholders})", ref_ids
+        ).fetchall()
+
+    title_cnt = len(source["title"])
+    documents = []
+
+    for row in rows:
+        ref_id, values = row[0], [value or "" for value in row[1:]]
+        title = " ".join(values[:title_cnt])
+        body = " ".join(values[title_cnt:])
+        documents.append((kind, str(ref_id), title, normalize(title), normalize(body)))
+
+    conn.executemany(
+        "INSERT INTO search_index (kind, ref_id, label, title, body) VALUES (?, ?, ?, ?, ?)",
+        documents,
+    )
+
+
+def refresh_all(conn):
+    for kind in SOURCES:
+        refresh_search_index(conn, kind)
+
+
+def search(conn, query, kinds=None, limit=20):
+    # every word of the query has to match a prefix of a word in the document,
+    # matches in the title are ranked higher than matches in the body
+    tokens = re.findall(r"\w+", normalize(query))
+
+    if not tokens:
+        return []
+
+    match = " ".join(f'"{token}"*' for token in tokens)
+    params = [match]
+    kinds_filter = ""
+
+    if kinds:
+        kinds_filter = f"AND kind IN ({', '.join('?' for _ in kinds)})"
+        params.extend(kinds)
+
+    rows = conn.execute(
+        f"""
+        SELECT kind, ref_id, label
+        FROM search_index
+        WHERE search_index MATCH ? {kinds_filter}
+        ORDER BY bm25(search_index, 0.0, 0.0, 0.0, 10.0, 1.0)
+        LIMIT ?
+        """,
+        params + [limit],
+    ).fetchall()
+
+    return [dict(row) for row in rows]
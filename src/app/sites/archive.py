@@ -63,7 +63,6 @@ def main():
 
             st.success("Změna ročníku byla úspěšná.")
             time.sleep(2)
-            utils.clear_cache()
             st.rerun()
 
     with columns[1]:
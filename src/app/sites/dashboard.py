@@ -3,7 +3,6 @@
 import streamlit as st
 from database import get_database
 import utils
-import random
 import pandas as pd
 
 st.set_page_config(
@@ -27,16 +26,16 @@ def back_btn():
     st.query_params.page = page
 
 
-def load_posts(db, team_filter=None, challenge_filter=None, checkpoint_filter=None):
-    posts = db.get_posts(team_filter, challenge_filter, checkpoint_filter)
+def load_posts(db, count, random_order=False):
+    if random_order:
+        posts = db.get_random_posts(count)
+    else:
+        posts, _ = db.get_posts_feed(page_size=count)
 
     if not posts:
         st.write("### Čekáme na vaše příspěvky! 💙")
         st.stop()
 
-    # sort by date
-    posts.sort(key=lambda x: x["created"], reverse=True)
-
     return posts
 
 
@@ -63,15 +62,8 @@ def show_overview():
         st.write("### Akce se blíží! 🚀")
         st.stop()
 
-    posts = load_posts(db)
-
-    post_gallery_cnt = min(3, len(posts))
-    if event["status"] == "past":
-        # select 3 random posts
-        posts = random.sample(posts, post_gallery_cnt)
-    elif event["status"] == "ongoing":
-        # select 3 last posts (posts is a dataframe)
-        posts = posts[:post_gallery_cnt]
+    # 3 random posts for past events, 3 last posts otherwise
+    posts = load_posts(db, count=3, random_order=event["status"] == "past")
 
     st.markdown(
         """
@@ -108,14 +100,13 @@ def show_overview():
             unsafe_allow_html=True,
         )
 
-    cols = st.columns(post_gallery_cnt, gap="large")
+    cols = st.columns(len(posts), gap="large")
 
     for col, post in zip(cols, posts):
         action_name = post["action_name"]
         action_type = post["action_type"]
         action_id = post.get("action_id")
 
-        team = db.get_team_by_id(post["team_id"])
         description = post["comment"]
 
         if action_type == "challenge":
@@ -131,7 +122,7 @@ def show_overview():
             action_type_icon = "✍️"
 
         post_id = post["post_id"]
-        link = f"<div style='margin-bottom:-10px; display:inline-block;'><h4><a href='posts?post={post_id}&event_id={event_id}' target='_self' class='app-link'>{action_type_icon} {action_name} – {team['team_name']}</a></div>"
+        link = f"<div style='margin-bottom:-10px; display:inline-block;'><h4><a href='posts?post={post_id}&event_id={event_id}' target='_self' class='app-link'>{action_type_icon} {action_name} – {post['team_name']}</a></div>"
 
         with col:
             st.markdown(link, unsafe_allow_html=True)
@@ -140,13 +131,12 @@ def show_overview():
             files = post["files"]
             for f in files:
                 if f["type"].startswith("image"):
-                    st.image(db.read_image(f["path"], thumbnail="150_square"))
+                    utils.show_image(db, f["path"], thumbnail="150_square")
                     break
             else:
                 for f in files:
                     if f["type"].startswith("video"):
-                        video_file = db.read_video(f["path"])
-                        st.video(video_file)
+                        utils.show_video(db, f["path"])
                         break
             st.markdown(
                 shorten(utils.escape_html(description), post_id, max_len=150),
@@ -162,16 +152,12 @@ def show_overview():
 
     if best_teams.empty:
         # find the teams with most points
-        teams_overview = db.get_teams_overview()
+        best_teams = db.get_leaderboard(limit=4)
 
-        if not teams_overview:
+        if best_teams.empty:
             st.info("Zatím nejsou zaregistrované žádné týmy.")
             st.stop()
 
-        best_teams = (
-            pd.DataFrame(teams_overview).sort_values("points", ascending=False).head(4)
-        )
-
         # if all best teams have 0 points, display warning that the game has not started yet
         if best_teams["points"].sum() == 0:
             st.info("Žádný tým zatím nezískal body.")
@@ -194,7 +180,6 @@ def show_overview():
             team_name = f"<h5>{db.get_team_link(team)}</h5>"
 
             img_path = team["team_photo"] or "static/team.png"
-            img = db.read_image(img_path, thumbnail="100_square")
 
             member1 = db.get_participant_by_id(team["member1"])
             members = [get_member_link(member1["id"], member1["name"])]
@@ -208,7 +193,7 @@ def show_overview():
                 members.append(get_member_link(member3["id"], member3["name"]))
 
             members = ", ".join(members)
-            st.image(img)
+            utils.show_image(db, img_path, thumbnail="100_square")
 
             st.markdown(f"{team_name}", unsafe_allow_html=True)
             st.markdown(
@@ -26,20 +26,11 @@ utils.page_wrapper()
 
 def main():
     st.title("Leaderboard")
-    teams_overview = db.get_teams_overview()
-
-    # teams_overview[i] contains a key "posts" with a df containing all the posts for the team
-    # compute how many occurences of each action type (challenge, checkpoint, ...) there were according to "action_type" column
-    for i, team in enumerate(teams_overview):
-        posts = team["posts"]
-        posts["action_type"].value_counts()
-        for action_type in ["challenge", "checkpoint", "story"]:
-            teams_overview[i][action_type] = (
-                posts["action_type"].value_counts().get(action_type, 0)
-            )
+    # the points are precomputed in the database, see `scores.py`
+    leaderboard = db.get_leaderboard(member_names=True)
 
     table = pd.DataFrame(
-        teams_overview,
+        leaderboard,
         columns=[
             "team_name",
             "points",
@@ -53,7 +44,6 @@ def main():
         ],
     )
 
-    table = table.sort_values(by="points", ascending=False)
     table = table.reset_index(drop=True)
     table.index += 1
     table.index.name = "Pořadí"
@@ -56,9 +56,9 @@ def show_profile(pax_id):
     with columns[2]:
         photo_path = pax["photo"]
         if photo_path:
-            st.image(db.read_image(photo_path, thumbnail="1000"))
+            utils.show_image(db, photo_path, thumbnail="1000")
         else:
-            st.image("static/avatar.png")
+            utils.show_image(db, "static/avatar.png")
 
 
 def get_profile_photo(pax):
@@ -145,9 +145,9 @@ def show_participants():
             team_name = pax["team_name"]
             team_id = pax["team_id"]
 
-            img = db.read_image(pax["profile_photo_view"], thumbnail="100_square")
-
-            st.image(img, width=80)
+            utils.show_image(
+                db, pax["profile_photo_view"], thumbnail="100_square", width=80
+            )
             st.markdown(f"{name}", unsafe_allow_html=True)
 
             if team_name:
@@ -178,7 +178,7 @@ def main():
             margin-left: auto;
             margin-right: auto;
         }
-    [data-testid=stImage] img{
+    [data-testid=stImage] img, img.media-image{
         border-radius: 50%;
         }
     
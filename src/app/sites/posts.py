@@ -33,18 +33,42 @@ def back_btn():
     del st.query_params["post"]
 
 
-def prev_page(page):
+def prev_page(page, first_post_id):
     st.query_params.page = page - 1
+    st.query_params.pop("after", None)
+
+    if page - 1 > 0:
+        st.query_params.before = first_post_id
+    else:
+        st.query_params.pop("before", None)
 
 
-def next_page(page):
+def next_page(page, last_post_id):
     st.query_params.page = page + 1
+    st.query_params.after = last_post_id
+    st.query_params.pop("before", None)
 
 
-def set_page():
+def set_page(team_filter, challenge_filter, checkpoint_filter, page_size):
     # get value of the slider `page_slider`
-    page = st.session_state.page_slider
-    st.query_params.page = page - 1
+    page = st.session_state.page_slider - 1
+    after = db.get_posts_feed_cursor(
+        team_filter, challenge_filter, checkpoint_filter, page=page, page_size=page_size
+    )
+    st.query_params.page = page
+    st.query_params.pop("before", None)
+
+    if after:
+        st.query_params.after = after
+    else:
+        st.query_params.pop("after", None)
+
+
+def reset_page():
+    # the cursor is not valid for different filters
+    st.query_params.page = 0
+    st.query_params.pop("after", None)
+    st.query_params.pop("before", None)
 
 
 def show_post(db, post_id):
@@ -97,47 +121,92 @@ def show_post(db, post_id):
         st.markdown(description, unsafe_allow_html=True)
         st.divider()
 
-    images = [
-        db.read_image(f["path"], thumbnail="1000")
-        for f in files
-        if f["type"].startswith("image")
-    ]
+    images = [f["path"] for f in files if f["type"].startswith("image")]
 
     if images:
         cols = st.columns(min(3, len(images)))
         for i, image in enumerate(images):
-            col = cols[i % 3]
-            col.image(image, use_column_width=True)
+            with cols[i % 3]:
+                utils.show_image(db, image, thumbnail="1000")
 
     videos = [f["path"] for f in files if f["type"].startswith("video")]
     if videos:
         for video in videos:
-            video_file = db.read_video(video)
-            st.video(video_file)
-
-
-def load_posts(db, team_filter=None, challenge_filter=None, checkpoint_filter=None):
-    posts = db.get_posts(team_filter, challenge_filter, checkpoint_filter)
+            utils.show_video(db, video)
+
+
+def load_posts(
+    db,
+    team_filter=None,
+    challenge_filter=None,
+    checkpoint_filter=None,
+    page_size=10,
+    after=None,
+    before=None,
+):
+    posts, total = db.get_posts_feed(
+        team_filter,
+        challenge_filter,
+        checkpoint_filter,
+        page_size=page_size,
+        after=after,
+        before=before,
+    )
 
-    if not posts:
+    if not total:
         st.write("### Čekáme na vaše příspěvky! 💙")
         st.stop()
 
-    # sort by date
-    posts.sort(key=lambda x: x["created"], reverse=True)
+    if not posts:
+        # the cursor points past the end of the feed, start from the beginning
+        reset_page()
+        posts, total = db.get_posts_feed(
+            team_filter, challenge_filter, checkpoint_filter, page_size=page_size
+        )
+
+    return posts, total
 
-    return posts
+
+def get_cursor_params():
+    # keep the position in the feed when returning from the post detail
+    return "".join(
+        f"&{key}={params[key]}" for key in ["after", "before"] if params.get(key)
+    )
 
 
 def shorten(s, post_id, page, max_len=250):
     if len(s) > max_len:
         return (
             s[:max_len]
-            + f"<b><a href='posts?post={post_id}&event_id={event_id}&page={page}' target='_self' class='app-link'> (...)</a></b>"
+            + f"<b><a href='posts?post={post_id}&event_id={event_id}&page={page}{get_cursor_params()}' target='_self' class='app-link'> (...)</a></b>"
         )
     return s
 
 
+def show_search_results(db, query):
+    st.title("Hledání")
+    results = db.search(query, limit=50)
+
+    if not results:
+        st.info("Nic jsme nenašli.")
+        return
+
+    for result in results:
+        kind = result["kind"]
+        ref_id = result["ref_id"]
+        label = utils.escape_html(result["label"])
+
+        if kind == "post":
+            team_name = utils.escape_html(result.get("team_name") or "")
+            link = f"<a href='posts?post={ref_id}&event_id={event_id}' target='_self' class='app-link'>✍️ {label} – {team_name}</a>"
+        elif kind == "team":
+            link = f"<a href='/teams?team_id={ref_id}&event_id={event_id}' target='_self' class='app-link'>👥 {label}</a>"
+        else:
+            link = f"<a href='/participants?id={ref_id}&event_id={event_id}' target='_self' class='app-link'>👤 {label}</a>"
+
+        st.markdown(link, unsafe_allow_html=True)
+
+
 def show_overview(db, page):
     team_options = [""] + sorted(list(db.get_teams()["team_name"]), key=str.lower)
     challenge_options = [""] + sorted(
@@ -159,33 +228,54 @@ def show_overview(db, page):
         """,
         unsafe_allow_html=True,
     )
+    search_query = st.sidebar.text_input(
+        "Hledat:", key="search_query", placeholder="Příspěvky, týmy, účastníci"
+    )
+
+    if search_query.strip():
+        show_search_results(db, search_query)
+        return
+
     st.sidebar.caption("Filtrovat feed")
     # st.sidebar.markdown("**Filtrovat**")
     team_filter = st.sidebar.selectbox(
-        "Tým:", options=team_options, key="team_filter_selector"
+        "Tým:",
+        options=team_options,
+        key="team_filter_selector",
+        on_change=reset_page,
     )
     challenge_filter = st.sidebar.selectbox(
-        "Výzvy:", options=challenge_options, key="challenge_filter_selector"
+        "Výzvy:",
+        options=challenge_options,
+        key="challenge_filter_selector",
+        on_change=reset_page,
     )
 
     checkpoint_filter = st.sidebar.selectbox(
-        "Checkpointy:", options=checkpoint_options, key="checkpoint_filter_selector"
+        "Checkpointy:",
+        options=checkpoint_options,
+        key="checkpoint_filter_selector",
+        on_change=reset_page,
     )
 
-    cols = st.columns([1, 3, 1])
+    page_size = 10
 
-    posts = load_posts(
+    posts, total = load_posts(
         db=db,
         team_filter=team_filter,
         challenge_filter=challenge_filter,
         checkpoint_filter=checkpoint_filter,
+        page_size=page_size,
+        after=params.get("after"),
+        before=params.get("before"),
     )
 
     col_layout = [5, 2]
-    cols = st.columns(col_layout)
 
-    page_size = 10
-    page_count = len(posts) // page_size + 1
+    page_count = (total - 1) // page_size + 1
+    # the position in the feed is given by the cursor, the page number only follows it
+    if not params.get("after") and not params.get("before"):
+        page = 0
     page = min(page, page_count - 1)
 
     center_cols = st.columns([1, 3, 1])
@@ -201,16 +291,14 @@ def show_overview(db, page):
             value=page + 1,
             key="page_slider",
             on_change=set_page,
+            args=(team_filter, challenge_filter, checkpoint_filter, page_size),
         )
 
-    posts = posts[page * page_size : (page + 1) * page_size]
-
     for post in posts:
         action_name = post["action_name"]
         action_type = post["action_type"]
         action_id = post.get("action_id")
 
-        team = db.get_team_by_id(post["team_id"])
         description = post["comment"]
 
         if action_type == "challenge":
@@ -227,9 +315,7 @@ def show_overview(db, page):
             action_type_icon = "✍️"
 
         post_id = post["post_id"]
-        team_link = db.get_team_link(team)
-
-        link = f"<div style='margin-bottom:-10px; display:inline-block;'><h4><a href='posts?post={post_id}&page={page}&event_id={event_id}' target='_self' class='app-link'>{action_type_icon} {action_name} – {team['team_name']}</a></div>"
+        link = f"<div style='margin-bottom:-10px; display:inline-block;'><h4><a href='posts?post={post_id}&page={page}&event_id={event_id}{get_cursor_params()}' target='_self' class='app-link'>{action_type_icon} {action_name} – {post['team_name']}</a></div>"
 
         st.markdown(link, unsafe_allow_html=True)
         cols = st.columns(col_layout)
@@ -244,22 +330,25 @@ def show_overview(db, page):
             files = post["files"]
             for f in files:
                 if f["type"].startswith("image"):
-                    st.image(db.read_image(f["path"], thumbnail="150_square"))
+                    utils.show_image(db, f["path"], thumbnail="150_square")
                     break
             else:
                 for f in files:
                     if f["type"].startswith("video"):
-                        video_file = db.read_video(f["path"])
-                        st.video(video_file)
+                        utils.show_video(db, f["path"])
                         break
 
         st.divider()
 
     bottom_cols = st.columns([1, 3, 1])
     if page > 0:
-        bottom_cols[0].button("Přechozí", args=(page,), on_click=prev_page)
+        bottom_cols[0].button(
+            "Přechozí", args=(page, posts[0]["post_id"]), on_click=prev_page
+        )
     if page < page_count - 1:
-        bottom_cols[2].button("Další", args=(page,), on_click=next_page)
+        bottom_cols[2].button(
+            "Další", args=(page, posts[-1]["post_id"]), on_click=next_page
+        )
 
 
 def main():
@@ -177,9 +177,9 @@ def show_profile(team_id):
         with columns[2]:
             photo_path = team["team_photo"]
             if photo_path:
-                st.image(db.read_image(photo_path, thumbnail="1000"))
+                utils.show_image(db, photo_path, thumbnail="1000")
             else:
-                st.image("static/team.png")
+                utils.show_image(db, "static/team.png")
 
 
 def get_member_link(member_id, member_name):
@@ -214,7 +214,6 @@ def show_teams():
         with subcol:
             team_name = f"<b style='font-size: 18px;'>{db.get_team_link(team)}</b>"
             img_path = team["team_photo"] or "static/team.png"
-            img = db.read_image(img_path, thumbnail="100_square")
 
             member1 = db.get_participant_by_id(team["member1"])
             members = [get_member_link(member1["id"], member1["name"])]
@@ -228,7 +227,7 @@ def show_teams():
                 members.append(get_member_link(member3["id"], member3["name"]))
 
             members = ", ".join(members)
-            st.image(img)
+            utils.show_image(db, img_path, thumbnail="100_square")
 
             st.markdown(f"{team_name}", unsafe_allow_html=True)
             st.markdown(
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+
+# Thumbnails of the uploaded images and the manifest of the existing ones (table `media`).
+# The manifest records which thumbnails were created for every original image, so that
+# reading a thumbnail does not have to probe the file system first.
+#
+# The thumbnails are rendered right after the upload in a pool of worker processes (see `submit`),
+# so that neither the uploader nor the first viewer has to wait for decoding the full-size photos.
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from PIL import Image, ImageOps
+
+import hashlib
+import io
+import multiprocessing
+import os
+import threading
+import utils
+
+# every image gets all of these thumbnails, stored next to the original as `{name}_{size}.jpg`
+THUMBNAIL_SIZES = ["100_square", "150_square", "1000"]
+
+# arguments of `utils.resize_image` for every thumbnail size
+THUMBNAIL_GEOMETRY = {
+    "100_square": {"max_width": 100, "crop_ratio": "1:1"},
+    "150_square": {"max_width": 150, "crop_ratio": "1:1"},
+    "1000": {"max_width": 1000},
+}
+
+# every thumbnail is derived from the next larger one (None = the original image),
+# ordered from the largest to the smallest, see `get_source` for the exceptions
+THUMBNAIL_CASCADE = [
+    ("1000", None),
+    ("150_square", "1000"),
+    ("100_square", "150_square"),
+]
+
+# JPEGs are decoded directly at the smallest scale (1/2, 1/4 or 1/8) which is still at least this large
+# in both dimensions, so the largest thumbnail never needs upscaling whatever the EXIF orientation is
+DRAFT_SIZE = 1000
+
+# used if the number of workers is not set in the settings (`thumbnail_workers`)
+DEFAULT_WORKERS = 2
+
+# how long (in seconds) a reader waits for the thumbnails being rendered in the background
+# before it renders them itself
+PENDING_TIMEOUT = 30
+
+
+def get_thumbnail_path(filepath, size):
+    return f"{os.path.splitext(filepath)[0]}_{size}.jpg"
+
+
+def create_media_table(conn):
+    # `variants` is a comma-separated list of the thumbnail sizes which exist for the image at `path`
+    conn.execute(
+        """CREATE TABLE if not exists media (
+            path text not null,
+            variants text,
+            primary key(path)
+        );"""
+    )
+
+
+def get_content_hash(content):
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+def get_media(conn, filepath):
+    # {"variants", "content_hash", "normalized"} or None if the image is not in the manifest
+    # (e.g. uploaded before the manifest existed)
+    # `normalized` means that the image was rotated to its canonical orientation and stripped of metadata at upload
+    row = conn.execute(
+        "SELECT variants, content_hash, normalized FROM media WHERE path = ?",
+        (filepath,),
+    ).fetchone()
+
+    if row is None:
+        return None
+
+    # `variants` is None if the existing thumbnails are not known yet
+    return {
+        "variants": (
+            None
+            if row["variants"] is None
+            else set(filter(None, row["variants"].split(",")))
+        ),
+        "content_hash": row["content_hash"],
+        "normalized": bool(row["normalized"]),
+    }
+
+
+def set_variants(conn, filepath, variants, content_hash=None, normalized=None):
+    # the hash and the flags of the original are kept if they are not known
+    # (e.g. when recording thumbnails found in the storage)
+    conn.execute(
+        """INSERT INTO media (path, variants, content_hash, normalized) VALUES (?, ?, ?, ?)
+        ON CONFLICT(path) DO UPDATE SET
+            variants = excluded.variants,
+            content_hash = COALESCE(excluded.content_hash, media.content_hash),
+            normalized = COALESCE(excluded.normalized, media.normalized)""",
+        (
+            filepath,
+            ",".join(size for size in THUMBNAIL_SIZES if size in variants),
+            content_hash,
+            None if normalized is None else int(normalized),
+        ),
+    )
+
+
+def set_normalized(conn, filepath, content_hash):
+    # marks the image as normalized, the recorded thumbnails (if any) are kept
+    conn.execute(
+        """INSERT INTO media (path, content_hash, normalized) VALUES (?, ?, 1)
+        ON CONFLICT(path) DO UPDATE SET
+            content_hash = excluded.content_hash,
+            normalized = 1""",
+        (filepath, content_hash),
+    )
+
+
+def get_cache_key(size, media):
+    # thumbnails are cached under their size (i.e. geometry) and the hash of the original,
+    # so a replaced original never gets the thumbnails of the previous one
+    return (size, media["content_hash"] if media else None)
+
+
+def delete_media(conn, filepath):
+    conn.execute("DELETE FROM media WHERE path = ?", (filepath,))
+
+
+def encode_jpeg(img):
+    img_byte_array = io.BytesIO()
+    img.convert("RGB").save(img_byte_array, format="JPEG")
+
+    return img_byte_array.getvalue()
+
+
+def get_source(images, size, source):
+    # a square cropped from a very wide or tall thumbnail would be smaller than requested,
+    # such squares are cropped from the original image instead
+    geometry = THUMBNAIL_GEOMETRY[size]
+
+    if (
+        source is not None
+        and geometry.get("crop_ratio")
+        and min(images[source].size) < geometry["max_width"]
+    ):
+        return images[None]
+
+    return images[source]
+
+
+def render_thumbnails(content, oriented=False):
+    # encoded image -> {size: encoded thumbnail}, runs either in a worker process or as a fallback in the app
+    # the image is decoded only once, the smaller thumbnails are derived from the larger ones
+    # `oriented` images (normalized at upload) do not need the EXIF orientation applied
+    img = Image.open(io.BytesIO(content))
+
+    if img.format in ["JPEG", "MPO"]:
+        img.draft("RGB", (DRAFT_SIZE, DRAFT_SIZE))
+
+    images = {None: img if oriented else ImageOps.exif_transpose(img)}
+
+    for size, source in THUMBNAIL_CASCADE:
+        images[size] = utils.resize_image(
+            get_source(images, size, source), **THUMBNAIL_GEOMETRY[size]
+        )
+
+    # the full-size image is not needed for encoding
+    del images[None]
+
+    return {size: encode_jpeg(images[size]) for size in THUMBNAIL_SIZES}
+
+
+pool = None
+pool_lock = threading.Lock()
+
+# the results are stored (manifest, storage uploads) in a thread of this executor,
+# the done callbacks would otherwise block the thread which manages the worker processes
+store_executor = ThreadPoolExecutor(max_workers=DEFAULT_WORKERS)
+
+# path of the original image -> event set once its background job is finished (successfully or not)
+pending = {}
+pending_lock = threading.Lock()
+
+
+def get_pool(max_workers):
+    global pool
+
+    with pool_lock:
+        if pool is None:
+            # the app is multi-threaded, forking it could leave the workers with locks held by other threads
+            pool = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+
+        return pool
+
+
+def reset_pool():
+    # e.g. after a worker crashed, the broken pool is replaced on the next `submit`
+    global pool
+
+    with pool_lock:
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+            pool = None
+
+
+def submit(filepath, content, store, max_workers=DEFAULT_WORKERS, oriented=False):
+    # renders the thumbnails of the image in the background and passes them to `store(thumbnails)`,
+    # returns False if the job could not be submitted (the thumbnails are then created lazily on the first view)
+    finished = threading.Event()
+
+    try:
+        future = get_pool(max_workers).submit(render_thumbnails, content, oriented)
+    except Exception as e:
+        utils.log(f"Cannot schedule thumbnails for {filepath}: {e}", level="warning")
+        reset_pool()
+        return False
+
+    with pending_lock:
+        pending[filepath] = finished
+
+    def store_result(future):
+        try:
+            store(future.result())
+        except Exception as e:
+            # the thumbnails are not in the manifest, `Database.read_thumbnail` creates them on the first view
+            utils.log(f"Cannot create thumbnails for {filepath}: {e}", level="warning")
+        finally:
+            with pending_lock:
+                pending.pop(filepath, None)
+
+            finished.set()
+
+    future.add_done_callback(lambda future: store_executor.submit(store_result, future))
+    return True
+
+
+def wait_pending(filepath, timeout=PENDING_TIMEOUT):
+    # waits until the background job for the image is finished, if there is one
+    with pending_lock:
+        finished = pending.get(filepath)
+
+    if finished is not None:
+        finished.wait(timeout)
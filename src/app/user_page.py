@@ -102,6 +102,9 @@ def create_post(db, user, action_type, action, comment, files, flags=None):
         )
         st.success("Příspěvek odeslán.")
         st.balloons()
+    except ValueError as e:
+        # e.g. an unsupported or too large photo
+        st.error(str(e))
     except Exception as e:
         st.error(f"Stala se chyba: {traceback.print_exc()}")
         # print stacktrace
@@ -576,7 +579,11 @@ def show_team_info(db, user, team):
             )
         with cols[1]:
             if team and team["team_photo"]:
-                st.image(db.read_image(team["team_photo"], thumbnail="150_square"))
+                st.image(
+                    db.read_image(
+                        team["team_photo"], thumbnail="150_square", encoded=True
+                    )
+                )
         submit_button = st.form_submit_button(
             label="Uložit tým", disabled=fields_disabled
         )
@@ -587,6 +594,8 @@ def show_team_info(db, user, team):
             st.error("Musíš zadat jméno týmu")
             st.stop()
 
+        utils.check_uploaded_photo(team_photo)
+
         member2 = available_paxes.iloc[member2]["id"]
 
         # we want to keep member3 if set by administrators but we do not want to give participants a way to set it themselves
@@ -603,7 +612,6 @@ def show_team_info(db, user, team):
             third_member=member3,
             current_team=team,
         )
-        st.cache_data.clear()
         st.success(f"Tým **{team_name}** uložen.")
         st.balloons()
         time.sleep(3)
@@ -633,12 +641,14 @@ def show_user_info(db, user):
             photo_img = participant["photo"]
 
             if photo_img:
-                st.image(db.read_image(photo_img, thumbnail="150_square"))
+                st.image(db.read_image(photo_img, thumbnail="150_square", encoded=True))
 
         submit_button = st.form_submit_button(label="Uložit profilové informace")
 
     # When the submit button is clicked
     if submit_button:
+        utils.check_uploaded_photo(photo)
+
         db.update_participant_info(
             username=user["username"],
             email=user["email"],
@@ -646,7 +656,6 @@ def show_user_info(db, user):
             emergency_contact=emergency_contact,
             photo=photo,
         )
-        st.cache_data.clear()
         st.success(f"Informace uloženy.")
         st.balloons()
         time.sleep(3)
@@ -684,7 +693,6 @@ def show_account_info(db, user):
                 "usernames"
             ] = db.am.accounts["credentials"]["usernames"]
 
-        utils.clear_cache()
         st.success(f"Informace uloženy.")
         st.balloons()
         time.sleep(3)
@@ -1,4 +1,5 @@
 #!/usr/bin/env python3
+import io
 import time
 import yaml
 import os
@@ -10,7 +11,6 @@ import smtplib
 import ssl
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-import subprocess
 import ffmpeg
 from datetime import datetime, timedelta
 import pytz
@@ -21,8 +21,11 @@ from streamlit_javascript import st_javascript
 from ftplib import FTP
 from pathlib import Path
 from unidecode import unidecode
+from pillow_heif import register_heif_opener
+from media_cache import get_media_cache
 
-TTL = 600
+# HEIC / HEIF photos can be opened by PIL
+register_heif_opener()
 
 
 def log(m, level="info"):
@@ -130,46 +133,130 @@ def convert_datetime_prague_to_server(dt):
     return dt
 
 
-def heic_to_jpg(input_file, output_file):
+# photo types accepted at upload, HEIC / HEIF photos are converted to JPEG
+PHOTO_TYPES = [
+    "image/jpeg",
+    "image/png",
+    "image/gif",
+    "image/webp",
+    "image/heic",
+    "image/heif",
+]
+HEIF_TYPES = ["image/heic", "image/heif"]
+MAX_PHOTO_SIZE_MB = 50
+
+
+# metadata dropped by `normalize_photo` (EXIF including GPS and embedded thumbnails, XMP, Photoshop blocks)
+STRIPPED_METADATA = ["exif", "xmp", "XML:com.adobe.xmp", "photoshop", "comment"]
+
+
+def normalize_photo(content, max_size=None, quality=90, convert_to=None):
+    # rotates the photo into its canonical orientation and strips the metadata, so that the readers
+    # never need to handle the EXIF orientation; only the color profile is kept
+    # photos with the longer side over `max_size` are downscaled, `quality` is used when re-encoding JPEGs
+    # `convert_to` is the format the photo is always saved in (e.g. JPEG for HEIC photos, which are decoded
+    # by pillow-heif with the rotation already applied), so that it is decoded and encoded only once
+    # returns the photo and whether it is normalized, i.e. False if it cannot be read or is an animation
+    # (kept as it is), the photo is returned unchanged if there is nothing to normalize
     try:
-        subprocess.run(["heif-convert", input_file, output_file], check=True)
-        # TODO add libimage-exiftool-perl as a dependency
-        subprocess.run(["exiftool", "-n", "-Orientation=1", output_file], check=True)
-    except subprocess.CalledProcessError:
-        raise Exception("Failed to convert HEIC to JPG. Is heif-convert installed?")
+        img = Image.open(io.BytesIO(content))
+        orientation = img.getexif().get(0x0112, 1)
+    except Exception as e:
+        log(f"Cannot normalize photo: {e}", level="warning")
+        return content, False
 
+    # MPO (from some phones and cameras) is a JPEG followed by more frames (e.g. a depth map)
+    # with their own metadata, only the first frame is kept as a plain JPEG
+    img_format = convert_to or ("JPEG" if img.format == "MPO" else img.format)
+    converted = img_format != img.format
+    has_metadata = any(key in img.info for key in STRIPPED_METADATA)
+    too_large = bool(max_size) and max(img.size) > max_size
 
-def postprocess_uploaded_photo(photo):
-    # photo is a Streamlit uploaded object
-    # generate a unique filename
-    photo_uuid = generate_uuid()
+    if orientation == 1 and not has_metadata and not too_large and not converted:
+        return content, True
 
-    # original suffix
-    photo_suffix = os.path.splitext(photo.name)[1].lower()
+    if not converted and getattr(img, "n_frames", 1) > 1:
+        # animations are kept as they are
+        return content, False
 
-    # generate a unique filename
-    photo_name = f"{photo_uuid}{photo_suffix}"
-    photo_path = f"/tmp/{photo_name}"
+    icc_profile = img.info.get("icc_profile")
 
-    # save as a temporary file
-    with open(photo_path, "wb") as f:
-        f.write(photo.read())
+    if too_large:
+        # JPEGs are decoded directly at a reduced scale if it is still large enough
+        scale = max_size / max(img.size)
+        img.draft(img.mode, (round(img.size[0] * scale), round(img.size[1] * scale)))
 
-    # if the photo is a HEIC, convert it to JPG
-    if photo.type in ["image/heic", "image/heif"]:
-        original_photo_path = photo_path
-        photo_path = f"/tmp/{photo_uuid}.jpg"
+    img = ImageOps.exif_transpose(img)
+
+    if too_large:
+        img.thumbnail((max_size, max_size), Image.LANCZOS)
+
+    img_byte_array = io.BytesIO()
+    params = {"format": img_format}
+
+    if icc_profile:
+        params["icc_profile"] = icc_profile
 
-        # TODO write about libheif as a dependency
-        heic_to_jpg(original_photo_path, photo_path)
+    if img_format == "JPEG":
+        params["quality"] = quality
 
-        os.remove(original_photo_path)
-        photo_name = f"{photo_uuid}.jpg"
+        if img.mode not in ["RGB", "L", "CMYK"]:
+            img = img.convert("RGB")
 
-    photo_content = open(photo_path, "rb").read()
-    os.remove(photo_path)
+    img.save(img_byte_array, **params)
 
-    return photo_content, photo_name
+    return img_byte_array.getvalue(), True
+
+
+def validate_uploaded_photo(photo):
+    # checked before anything is stored, the message is shown to the user
+    if photo.type not in PHOTO_TYPES:
+        raise ValueError(f"Nepodporovaný formát fotky: {photo.name}")
+
+    if photo.size > MAX_PHOTO_SIZE_MB * 1024 * 1024:
+        raise ValueError(
+            f"Fotka {photo.name} je příliš velká (maximum je {MAX_PHOTO_SIZE_MB} MB)."
+        )
+
+
+def check_uploaded_photo(photo):
+    # for the forms: shows the error and stops the page if the photo cannot be accepted
+    if not photo:
+        return
+
+    try:
+        validate_uploaded_photo(photo)
+    except ValueError as e:
+        st.error(str(e))
+        st.stop()
+
+
+def postprocess_uploaded_photo(photo, max_size=None, quality=90):
+    # photo is a Streamlit uploaded object, it is processed in memory
+    # see `normalize_photo` for `max_size`, `quality` and whether the photo is normalized
+    validate_uploaded_photo(photo)
+
+    # generate a unique filename with the original suffix
+    photo_uuid = generate_uuid()
+    photo_suffix = os.path.splitext(photo.name)[1].lower()
+    photo_content = photo.getvalue()
+
+    convert_to = None
+
+    # if the photo is a HEIC, convert it to JPG
+    if photo.type in HEIF_TYPES:
+        convert_to = "JPEG"
+        photo_suffix = ".jpg"
+
+    photo_content, normalized = normalize_photo(
+        photo_content, max_size, quality, convert_to
+    )
+
+    if convert_to and not normalized:
+        # the HEIC photo could not be converted, it would be stored as a JPG
+        raise ValueError(f"Fotku {photo.name} se nepodařilo zpracovat.")
+
+    return photo_content, f"{photo_uuid}{photo_suffix}", normalized
 
 
 def postprocess_ffmpeg(input_file, output_file):
@@ -225,7 +312,37 @@ def postprocess_uploaded_video(video):
     return video_content, video_name
 
 
-@st.cache_resource(ttl=TTL)
+def show_image(db, filepath, thumbnail=None, width=None):
+    # the browser loads the image directly by URL (see `Database.get_media_url`),
+    # the image goes through the app only if it cannot be served by URL
+    url = db.get_media_url(filepath, thumbnail=thumbnail)
+
+    if url is None:
+        st.image(
+            db.read_image(filepath, thumbnail=thumbnail, encoded=True), width=width
+        )
+        return
+
+    style = f"width: {width}px;" if width else "max-width: 100%;"
+    st.markdown(
+        f"<img src='{url}' class='media-image' style='{style} margin-bottom: 1rem;' loading='lazy'>",
+        unsafe_allow_html=True,
+    )
+
+
+def show_video(db, filepath):
+    url = db.get_media_url(filepath)
+
+    if url is None:
+        st.video(db.read_video(filepath))
+        return
+
+    st.markdown(
+        f"<video src='{url}' style='width: 100%;' controls preload='metadata'></video>",
+        unsafe_allow_html=True,
+    )
+
+
 def resize_image(img, max_width=None, max_height=None, crop_ratio=None, circle=False):
     # create a copy of img
 
@@ -283,7 +400,12 @@ def check_ram_limit():
             f"Used RAM: {used_percentage}%, clearing cache and calling garbage collector.",
             "debug",
         )
-        clear_cache()
+        # the media and the query results are the largest caches kept in memory
+        get_media_cache().clear()
+        # imported here, `database` imports this module
+        import database
+
+        database.clear_query_caches()
         gc.collect()
 
 
@@ -387,7 +509,6 @@ def page_wrapper():
 
         if show_active_btn:
             st.session_state.event = None
-            clear_cache()
             st.rerun()
 
     # st.logo("static/logo_icon.png")
@@ -468,6 +589,7 @@ def clear_cache():
     log("Clearing cache", "debug")
     st.cache_resource.clear()
     st.cache_data.clear()
+    get_media_cache().clear()
 
 
 def sort_challenges(challenges):